@@ -0,0 +1,138 @@
+# Import the necessary modules
+import numpy as np
+
+# Status codes of a person
+SUSCEPTIBLE = 0
+INFECTIOUS = 1
+RECOVERED = 2
+
+# Infection day of a person who has not been infected
+NEVER_INFECTED = -1
+
+class AgentStore:
+    '''
+    Population of agents stored as typed columns, one entry per agent, which are updated in place every day
+
+    Every agent takes a fixed number of bytes: one for its status, four for the day it was infected, ten for the buffers reused every day, and the size of each added attribute.
+
+    Parameters:
+    - numPeople (int): number of agents
+    - numInfectious (int): number of agents who are infectious at the start, which are the first ones as in initPopulation
+    '''
+    def __init__(self, numPeople, numInfectious = 5):
+        numInfectious = min(numInfectious, numPeople)
+        self.numPeople = numPeople
+        self.state = np.full(numPeople, SUSCEPTIBLE, dtype = np.int8)
+        self.state[:numInfectious] = INFECTIOUS
+        self.infectionDay = np.full(numPeople, NEVER_INFECTED, dtype = np.int32)
+        self.infectionDay[:numInfectious] = 0
+        self.attributes = {}
+        # Buffers for the random numbers and the agents who change status, reused every day so that a step allocates nothing in proportion to the population
+        self.draws = np.empty(numPeople)
+        self.changed = np.empty(numPeople, dtype = bool)
+        self.eligible = np.empty(numPeople, dtype = bool)
+        self.numSusceptible = numPeople - numInfectious
+        self.numInfectious = numInfectious
+        self.numRecovered = 0
+
+    def addAttribute(self, name, dtype, fill = 0):
+        '''
+        Adds a column with a value of the given type for every agent
+
+        Parameters:
+        - name (string): name of the attribute
+        - dtype (numpy.dtype): type of the values
+        - fill: value that every agent starts with
+
+        Returns:
+        - column (numpy.ndarray): the column of the attribute, which can be changed in place
+        '''
+        if name in self.attributes:
+            raise ValueError("Attribute already exists: " + str(name))
+        self.attributes[name] = np.full(self.numPeople, fill, dtype = dtype)
+        return self.attributes[name]
+
+    @property
+    def nbytes(self):
+        '''
+        Number of bytes taken by the columns and buffers of the store
+        '''
+        columns = [self.state, self.infectionDay, self.draws, self.changed, self.eligible, *self.attributes.values()]
+        return sum(column.nbytes for column in columns)
+
+    def counts(self):
+        '''
+        Gets the number of susceptible, infectious and recovered agents
+
+        Returns:
+        - stats (list): the count of susceptible, infectious and recovered agents
+        '''
+        return [self.numSusceptible, self.numInfectious, self.numRecovered]
+
+    def transition(self, fromState, toState, prob, rng, day):
+        '''
+        Moves every agent in one status to another with the given probability, in place
+
+        Parameters:
+        - fromState (int): status code of the agents that may change
+        - toState (int): status code they change to
+        - prob (float): probability that each of them changes
+        - rng (numpy.random.Generator): random number generator to draw from
+        - day (int): the current day, counting from 1, recorded as the infection day of newly infectious agents
+
+        Returns:
+        - numChanged (int): number of agents who changed status
+        '''
+        rng.random(out = self.draws)
+        np.equal(self.state, fromState, out = self.eligible)
+        np.less(self.draws, prob, out = self.changed)
+        np.logical_and(self.changed, self.eligible, out = self.changed)
+        np.putmask(self.state, self.changed, toState)
+        if toState == INFECTIOUS:
+            np.putmask(self.infectionDay, self.changed, day)
+        return int(np.count_nonzero(self.changed))
+
+    def step(self, recoverProb, contactRate, rng, day):
+        '''
+        Advances the population by one day: some infectious agents recover, and then some susceptible agents get infected
+
+        Parameters:
+        - recoverProb (float): probability of recovery in a time step
+        - contactRate (float): rate of contact between a susceptible and an infectious agent in each time step
+        - rng (numpy.random.Generator): random number generator to draw from
+        - day (int): the day being simulated, counting from 1
+
+        Returns:
+        - stats (list): the count of susceptible, infectious and recovered agents at the end of the day
+        '''
+        numNewRecovered = self.transition(INFECTIOUS, RECOVERED, recoverProb, rng, day)
+        self.numInfectious = self.numInfectious - numNewRecovered
+        self.numRecovered = self.numRecovered + numNewRecovered
+
+        numNewInfectious = self.transition(SUSCEPTIBLE, INFECTIOUS, contactRate * self.numInfectious / self.numPeople, rng, day)
+        self.numSusceptible = self.numSusceptible - numNewInfectious
+        self.numInfectious = self.numInfectious + numNewInfectious
+        return self.counts()
+
+def agentSteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the change in the population day by day, keeping every person in an AgentStore
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    agents = AgentStore(numPeople)
+    for day in range(1, numDay + 1):
+        stats = agents.step(recoverProb, contactRate, rng, day)
+        yield stats
+        if stats[0] == 0 or stats[1] == 0:
+            break
@@ -0,0 +1,242 @@
+# Import the necessary modules
+import numpy as np
+
+class Transition:
+    '''
+    Movement of people from one compartment to another, each with the same probability every day
+
+    Parameters:
+    - source (string): compartment people leave
+    - target (string): compartment people enter
+    - prob (float or string): probability that each person in the source moves on a day, or the name of the parameter that gives it, such as 'recoverProb'
+    - infectedBy (tuple): compartments whose people infect; if given, prob is a contact rate and the probability is prob times the fraction of the population in these compartments, as in main.infect
+    '''
+    def __init__(self, source, target, prob, infectedBy = ()):
+        self.source = source
+        self.target = target
+        self.prob = prob
+        self.infectedBy = tuple(infectedBy)
+
+    def __repr__(self):
+        return "Transition(%r, %r, %r, infectedBy = %r)" % (self.source, self.target, self.prob, self.infectedBy)
+
+class CompartmentModel:
+    '''
+    Compartmental model given by its compartments and the transitions between them, which one vectorized kernel simulates for many replicates at once, keeping only the number of people in each compartment
+
+    Every day, the transitions are applied one after another in the order given, each to the people left in its source compartment, so a person makes at most one move per transition on a day.
+    The model can be given as the engine of the simulation functions of main, which report the compartments summed into susceptible, infectious and recovered people.
+
+    Parameters:
+    - name (string): name of the model
+    - compartments (list): names of the compartments; everyone starts in the first one except the first infectious people
+    - transitions (list): the Transition objects of the model, in the order they are applied every day
+    - reported (tuple): for each of the susceptible, infectious and recovered counts reported to main, the compartments summed into it
+    - endWhenEmpty (tuple): groups of compartments; a replicate stops changing once every compartment of one group is empty, like a simulation of main that ends early
+    - parameters (dict): values of the parameters named by the transitions, other than recoverProb and contactRate, which the simulation functions give
+    - seedCompartment (string): compartment of the first infectious people
+    - numInfectious (int): number of people in seedCompartment at the start, as in main.initPopulation
+    '''
+    def __init__(self, name, compartments, transitions, reported, endWhenEmpty, parameters = None, seedCompartment = 'I', numInfectious = 5):
+        self.name = name
+        self.compartments = list(compartments)
+        self.transitions = list(transitions)
+        self.reported = tuple(tuple(group) for group in reported)
+        self.endWhenEmpty = tuple(tuple(group) for group in endWhenEmpty)
+        self.parameters = dict(parameters or {})
+        self.seedCompartment = seedCompartment
+        self.numInfectious = numInfectious
+        named = [transition.prob for transition in self.transitions if isinstance(transition.prob, str)]
+        missing = set(named) - set(self.parameters) - {'recoverProb', 'contactRate'}
+        if missing:
+            raise ValueError("Missing parameters of the " + name + " model: " + ", ".join(sorted(missing)))
+        # Positions of the compartments in the arrays of counts, looked up once rather than every day
+        position = {compartment: index for index, compartment in enumerate(self.compartments)}
+        try:
+            self.steps = [(position[transition.source], position[transition.target], transition.prob, [position[compartment] for compartment in transition.infectedBy]) for transition in self.transitions]
+            self.reportedIndices = [[position[compartment] for compartment in group] for group in self.reported]
+            self.endIndices = [[position[compartment] for compartment in group] for group in self.endWhenEmpty]
+            self.seedIndex = position[seedCompartment]
+        except KeyError as error:
+            raise ValueError("Unknown compartment of the " + name + " model: " + str(error.args[0]))
+
+    def __repr__(self):
+        # The representation is part of the cache keys of the results, so it holds the whole specification
+        return "CompartmentModel(%r, %r, %r, reported = %r, endWhenEmpty = %r, parameters = %r, seedCompartment = %r, numInfectious = %r)" % (
+            self.name, self.compartments, self.transitions, self.reported, self.endWhenEmpty, self.parameters, self.seedCompartment, self.numInfectious)
+
+    def __eq__(self, other):
+        return isinstance(other, CompartmentModel) and repr(other) == repr(self)
+
+    def __hash__(self):
+        return hash(repr(self))
+
+    def withParameters(self, **parameters):
+        '''
+        Makes the same model with other values of some of its parameters
+
+        Parameters:
+        - parameters: new values of parameters of the model, such as incubationProb = 0.5
+
+        Returns:
+        - model (CompartmentModel): the new model
+        '''
+        return CompartmentModel(self.name, self.compartments, self.transitions, self.reported, self.endWhenEmpty, {**self.parameters, **parameters}, self.seedCompartment, self.numInfectious)
+
+    def compartmentSteps(self, numDay, numPeople, recoverProb, contactRate, numReplicates, rng = None):
+        '''
+        Simulates the number of people in every compartment day by day for many replicates at once
+
+        Parameters:
+        - numDay (int): number of days over which the simulation takes place
+        - numPeople (int): number of people in a population
+        - recoverProb (float): value of the recoverProb parameter
+        - contactRate (float): value of the contactRate parameter
+        - numReplicates (int): number of simulations to run
+        - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+        Returns:
+        - a generator of arrays of shape (numReplicates, number of compartments) with the count of people in every compartment of every simulation on each day, which stops early once every simulation has ended
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        values = {**self.parameters, 'recoverProb': recoverProb, 'contactRate': contactRate}
+        steps = [(source, target, values[prob] if isinstance(prob, str) else prob, infectedBy) for source, target, prob, infectedBy in self.steps]
+        # One row of counts per compartment, so that the counts of a compartment are contiguous
+        counts = np.zeros((len(self.compartments), numReplicates), dtype = np.int64)
+        counts[self.seedIndex] = min(self.numInfectious, numPeople)
+        counts[0] += numPeople - counts[self.seedIndex]
+        # Replicates that have ended stop changing, like a simulation that ends early
+        active = np.ones(numReplicates, dtype = bool)
+        for day in range(numDay):
+            # People in a compartment are interchangeable, so the number who move is a single binomial draw per transition and replicate
+            for source, target, prob, infectedBy in steps:
+                if infectedBy:
+                    numInfectious = counts[infectedBy[0]] if len(infectedBy) == 1 else counts[infectedBy].sum(axis = 0)
+                    prob = np.minimum(1.0, prob * numInfectious / numPeople)
+                numMoved = rng.binomial(counts[source], prob)
+                numMoved *= active
+                counts[source] -= numMoved
+                counts[target] += numMoved
+            yield counts.T.copy()
+            for group in self.endIndices:
+                active &= (counts[group[0]] if len(group) == 1 else counts[group].sum(axis = 0)) > 0
+            if not active.any():
+                break
+
+    def scalarSteps(self, numDay, numPeople, recoverProb, contactRate, rng = None):
+        '''
+        Simulates the number of people in every compartment day by day for a single replicate, with the same random numbers as compartmentSteps; with one replicate, NumPy calls on arrays of one number would take most of the time, so the counts are Python integers
+
+        Returns:
+        - a generator of lists with the count of people in every compartment on each day, which stops early when the simulation ends
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        values = {**self.parameters, 'recoverProb': recoverProb, 'contactRate': contactRate}
+        steps = [(source, target, values[prob] if isinstance(prob, str) else prob, infectedBy) for source, target, prob, infectedBy in self.steps]
+        counts = [0] * len(self.compartments)
+        counts[self.seedIndex] = min(self.numInfectious, numPeople)
+        counts[0] += numPeople - counts[self.seedIndex]
+        binomial = rng.binomial
+        for day in range(numDay):
+            for source, target, prob, infectedBy in steps:
+                if infectedBy:
+                    prob = min(1.0, prob * sum(map(counts.__getitem__, infectedBy)) / numPeople)
+                numMoved = int(binomial(counts[source], prob))
+                counts[source] -= numMoved
+                counts[target] += numMoved
+            yield counts.copy()
+            if not all(map(any, ([counts[index] for index in group] for group in self.endIndices))):
+                break
+
+    def batchSteps(self, numDay, numPeople, recoverProb, contactRate, numReplicates, rng = None):
+        '''
+        Simulates the change in the population day by day for many replicates at once, with the same arguments and results as the batch engines of main
+
+        Returns:
+        - a generator of arrays of shape (numReplicates, 3) with the reported count of susceptible, infectious and recovered people in every simulation on each day, which stops early once every simulation has ended
+        '''
+        for counts in self.compartmentSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, rng):
+            yield self.report(counts)
+
+    def report(self, counts):
+        '''
+        Sums the counts of the compartments into the reported counts of susceptible, infectious and recovered people
+
+        Parameters:
+        - counts (numpy.ndarray): an array with the count of people in every compartment along its last axis
+
+        Returns:
+        - stats (numpy.ndarray): an array with the susceptible, infectious and recovered counts along its last axis
+        '''
+        if self.reportedIndices == [[0], [1], [2]] and counts.shape[-1] == 3:
+            return counts
+        return np.stack([counts[..., group].sum(axis = -1) for group in self.reportedIndices], axis = -1)
+
+    def __call__(self, numDay, numPeople, recoverProb, contactRate, rng = None):
+        '''
+        Simulates the change in the population day by day, with the same arguments and results as the engines of main
+
+        Returns:
+        - a generator of the daily reported count of susceptible, infectious and recovered people, which stops early when the simulation ends
+        '''
+        for counts in self.scalarSteps(numDay, numPeople, recoverProb, contactRate, rng):
+            yield [sum(counts[index] for index in group) for group in self.reportedIndices]
+
+# The model of main: infectious people recover, and then susceptible people get infected by the infectious people left
+SIR = CompartmentModel(
+    'sir',
+    ['S', 'I', 'R'],
+    [
+        Transition('I', 'R', 'recoverProb'),
+        Transition('S', 'I', 'contactRate', infectedBy = ['I']),
+    ],
+    reported = (['S'], ['I'], ['R']),
+    endWhenEmpty = (['S'], ['I']),
+)
+
+# Infected people are exposed, and not yet infectious, for 1 / incubationProb days on average; both exposed and infectious people are reported as infectious
+SEIR = CompartmentModel(
+    'seir',
+    ['S', 'E', 'I', 'R'],
+    [
+        Transition('I', 'R', 'recoverProb'),
+        Transition('E', 'I', 'incubationProb'),
+        Transition('S', 'E', 'contactRate', infectedBy = ['I']),
+    ],
+    reported = (['S'], ['E', 'I'], ['R']),
+    endWhenEmpty = (['E', 'I'],),
+    parameters = {'incubationProb': 0.2},
+)
+
+# Recovered people lose their immunity after 1 / waningProb days on average
+SIRS = CompartmentModel(
+    'sirs',
+    ['S', 'I', 'R'],
+    [
+        Transition('I', 'R', 'recoverProb'),
+        Transition('S', 'I', 'contactRate', infectedBy = ['I']),
+        Transition('R', 'S', 'waningProb'),
+    ],
+    reported = (['S'], ['I'], ['R']),
+    endWhenEmpty = (['I'],),
+    parameters = {'waningProb': 0.01},
+)
+
+# Susceptible people who escape infection are vaccinated with probability vaccinationProb every day; vaccinated people are reported with the recovered, as both are immune
+SIRV = CompartmentModel(
+    'sirv',
+    ['S', 'I', 'R', 'V'],
+    [
+        Transition('I', 'R', 'recoverProb'),
+        Transition('S', 'I', 'contactRate', infectedBy = ['I']),
+        Transition('S', 'V', 'vaccinationProb'),
+    ],
+    reported = (['S'], ['I'], ['R', 'V']),
+    endWhenEmpty = (['S'], ['I']),
+    parameters = {'vaccinationProb': 0.01},
+)
+
+# The predefined models, by name
+MODELS = {model.name: model for model in (SIR, SEIR, SIRS, SIRV)}
@@ -0,0 +1,158 @@
+# Import the necessary modules
+import contextlib
+import contextvars
+import threading
+import time
+
+# Whether timers and counters record anything; when False they return at once, so they can stay in the hot paths
+enabled = False
+
+# Recording of the request or job being handled in the current thread or task, if any
+currentRecording = contextvars.ContextVar('currentRecording', default = None)
+
+# Totals over the life of the process, for the metrics endpoint
+lock = threading.Lock()
+phaseTotals = {}
+counterTotals = {}
+
+# Shared timer that does nothing, returned while instrumentation is disabled
+NO_TIMER = contextlib.nullcontext()
+
+class Recording:
+    '''
+    Time spent in every phase and counters of one request
+    '''
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+
+class Timer:
+    '''
+    Context manager that adds the time spent in it to a phase
+
+    Parameters:
+    - name (string): name of the phase
+    '''
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        addPhase(self.name, time.perf_counter() - self.start)
+        return False
+
+def timer(name):
+    '''
+    Times a phase of the work, such as simulating or encoding a graph
+
+    Parameters:
+    - name (string): name of the phase
+
+    Returns:
+    - timer: a context manager that adds the time spent in it to the phase
+    '''
+    if not enabled:
+        return NO_TIMER
+    return Timer(name)
+
+def addPhase(name, seconds):
+    '''
+    Adds time to a phase, in the current recording and in the totals
+
+    Parameters:
+    - name (string): name of the phase
+    - seconds (float): time spent in the phase
+    '''
+    recording = currentRecording.get()
+    if recording is not None:
+        recording.phases[name] = recording.phases.get(name, 0.0) + seconds
+    with lock:
+        calls, total = phaseTotals.get(name, (0, 0.0))
+        phaseTotals[name] = (calls + 1, total + seconds)
+
+def count(name, value = 1):
+    '''
+    Adds to a counter, such as the number of person-days simulated
+
+    Parameters:
+    - name (string): name of the counter
+    - value (int): amount to add
+    '''
+    if not enabled:
+        return
+    recording = currentRecording.get()
+    if recording is not None:
+        recording.counters[name] = recording.counters.get(name, 0) + value
+    with lock:
+        counterTotals[name] = counterTotals.get(name, 0) + value
+
+def startRecording():
+    '''
+    Starts recording the phases and counters of a request in the current thread or task
+
+    Returns:
+    - token: the token to give to finishRecording
+    '''
+    return currentRecording.set(Recording())
+
+def finishRecording(token):
+    '''
+    Stops the recording started by startRecording
+
+    Parameters:
+    - token: the token returned by startRecording
+
+    Returns:
+    - recording (Recording): the phases and counters recorded
+    '''
+    recording = currentRecording.get()
+    currentRecording.reset(token)
+    return recording
+
+def serverTiming(recording, total = None):
+    '''
+    Formats a recording as the value of a Server-Timing header
+
+    Parameters:
+    - recording (Recording): the phases of a request
+    - total (float): time taken by the whole request in seconds, added as the 'total' phase if given
+
+    Returns:
+    - value (string): the header value, with the duration of every phase in milliseconds
+    '''
+    phases = dict(recording.phases)
+    if total is not None:
+        phases['total'] = total
+    return ', '.join('%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in phases.items())
+
+def prometheusText():
+    '''
+    Formats the totals of the process in the Prometheus text format
+
+    Returns:
+    - text (string): the metrics
+    '''
+    with lock:
+        phases = sorted(phaseTotals.items())
+        counters = sorted(counterTotals.items())
+    lines = [
+        '# HELP sir_phase_seconds_total Time spent in each phase of the simulations and graphs.',
+        '# TYPE sir_phase_seconds_total counter',
+    ]
+    lines += ['sir_phase_seconds_total{phase="%s"} %.6f' % (name, total) for name, (calls, total) in phases]
+    lines += [
+        '# HELP sir_phase_calls_total Number of times each phase ran.',
+        '# TYPE sir_phase_calls_total counter',
+    ]
+    lines += ['sir_phase_calls_total{phase="%s"} %d' % (name, calls) for name, (calls, total) in phases]
+    for name, value in counters:
+        lines += [
+            '# TYPE sir_%s_total counter' % name,
+            'sir_%s_total %d' % (name, value),
+        ]
+    return '\n'.join(lines) + '\n'
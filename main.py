@@ -1,143 +1,1691 @@
 # Import the necessary modules
+import os
 import random
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import json
+import math
+import time
+from statistics import NormalDist
+import numpy as np
+from resultcache import ResultCache, cacheKey
+import instrumentation
+# Status codes of a person in the NumPy engines, shared with the agent store
+from agents import SUSCEPTIBLE, INFECTIOUS, RECOVERED, agentSteps
+# Compartmental models simulated by one vectorized kernel, of which the SIR model of the binomial engine is one
+from compartments import CompartmentModel, SIR, SEIR, SIRS, SIRV
+
+# Version of the simulation results; change it whenever an engine changes what it returns for a seed so that cached results are not reused
+ENGINE_VERSION = 1
+
+# Cache of seeded simulation results and rendered graphs, in memory and in the directory given by the SIR_CACHE_DIR environment variable
+resultCache = ResultCache(os.environ.get('SIR_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.simcache')))
+
+
+def makeRng(seed = None):
+    '''
+    Makes the random number generator of a simulation
+
+    Parameters:
+    - seed (int, numpy.random.SeedSequence or numpy.random.Generator): seed of the random numbers; a generator is used as it is, and None gives fresh randomness
+
+    Returns:
+    - rng (numpy.random.Generator): the random number generator
+    '''
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+def seedEntropy(seed):
+    '''
+    Turns a seed into the entropy from which the random streams of the replicates are derived
+
+    Parameters:
+    - seed (int, numpy.random.SeedSequence or numpy.random.Generator): seed of the random numbers; a generator is advanced to draw the entropy, and None gives fresh randomness
+
+    Returns:
+    - entropy (int or list): entropy for numpy.random.SeedSequence, or None for fresh randomness
+    '''
+    if isinstance(seed, np.random.Generator):
+        return seed.integers(2 ** 32, size = 4).tolist()
+    if isinstance(seed, np.random.SeedSequence):
+        return seed.generate_state(4).tolist()
+    return seed
+
+def isReproducible(seed):
+    '''
+    Checks whether a seed determines the results on its own, so that they can be cached
+
+    Parameters:
+    - seed: seed given to a simulation
+
+    Returns:
+    - reproducible (bool): True if the seed is an integer
+    '''
+    return isinstance(seed, (int, np.integer)) and not isinstance(seed, bool)
 
 def initPopulation(numPeople):
     '''
-    Creates an intial population
+    Creates an intial population
+
+    Parameters:
+    - numPeople (int): number of people in a population
+
+    Returns:
+    - population (list): a list of people in a population
+    '''
+    # Create a population with 5 intial infectious people
+    population = ['infectious'] * 5 + ['susceptible'] * (numPeople - 5)
+    return population
+
+def recover(population, recoverProb, rng = random):
+    '''
+    Modifies the population after some people recover
+
+    Parameters:
+    - population (list): a list of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - rng (random.Random or numpy.random.Generator): source of random numbers; the random module if not given
+
+    Returns:
+    - newpopulation (list): a list of people in a population after some recover
+    '''
+    # Assign to newpopulation an empty list
+    newpopulation = []
+    # Add to the newpopulation list a recovered person if the person is infectious and recovers; otherwise, add a person with the current status
+    for person in population:
+        if person == 'infectious' and rng.random() < recoverProb:
+            newpopulation.append('recovered')
+        else:
+            newpopulation.append(person)
+    return newpopulation
+
+def infect(population, contactRate, rng = random):
+    '''
+    Modifies the population after some people get infected
+
+    Parameters:
+    - population (list): a list of people in a population
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (random.Random or numpy.random.Generator): source of random numbers; the random module if not given
+
+    Returns:
+    - newpopulation (list): a list of people in a population after some get infected
+    '''
+    # Assign to newpopulation an empty list
+    newpopulation = []
+    # Count the number of infectious people
+    numInfectious = population.count('infectious')
+    # Append to the newpopulation list an infectious person if the person is susceptible and get infected; otherwise, add a person with the current status
+    for person in population:
+        if person == 'susceptible' and rng.random() < contactRate * numInfectious / len(population):
+            newpopulation.append('infectious')
+        else:
+            newpopulation.append(person)
+    return newpopulation
+
+def listSteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the change in the population day by day, storing every person as a string in a list
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (random.Random or numpy.random.Generator): source of random numbers; the random module if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    if rng is None:
+        rng = random
+    # Make a list of initial population
+    population = initPopulation(numPeople)
+    # Loop through the number of days to change the statuses of people in the population if applicable; if the number of susceptible or infectious people reaches 0, simulation ends early
+    for day in range(numDay):
+        population = recover(population, recoverProb, rng)
+        population = infect(population, contactRate, rng)
+        yield [population.count('susceptible'), population.count('infectious'), population.count('recovered')]
+        if population.count('susceptible') == 0:
+            break
+        elif population.count('infectious') == 0:
+            break
+
+def numpySteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the change in the population day by day, storing every person as a status code in a NumPy array
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    # Make an array of initial population with one byte per person and the same composition as initPopulation
+    numInfectious = min(5, numPeople)
+    population = np.full(numPeople, SUSCEPTIBLE, dtype = np.int8)
+    population[:numInfectious] = INFECTIOUS
+    numSusceptible = numPeople - numInfectious
+    numRecovered = 0
+    # Reuse one buffer for the random numbers drawn for the whole population every time step; they are double precision, as single precision ones are multiples of 2 ** -24, which would bias the tiny probabilities of infection of large populations upwards
+    draws = np.empty(numPeople)
+    # Loop through the number of days, drawing one random number per person for recovery and then for infection, and keep the counts up to date from the number of people who change status
+    for day in range(numDay):
+        rng.random(out = draws)
+        recovered = (population == INFECTIOUS) & (draws < recoverProb)
+        population[recovered] = RECOVERED
+        numNewRecovered = int(np.count_nonzero(recovered))
+        numInfectious = numInfectious - numNewRecovered
+        numRecovered = numRecovered + numNewRecovered
+
+        rng.random(out = draws)
+        infected = (population == SUSCEPTIBLE) & (draws < contactRate * numInfectious / numPeople)
+        population[infected] = INFECTIOUS
+        numNewInfectious = int(np.count_nonzero(infected))
+        numSusceptible = numSusceptible - numNewInfectious
+        numInfectious = numInfectious + numNewInfectious
+
+        yield [numSusceptible, numInfectious, numRecovered]
+        if numSusceptible == 0 or numInfectious == 0:
+            break
+
+def binomialSteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the change in the population day by day, keeping only the number of people in each group
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    # Start from the same composition as initPopulation
+    numInfectious = min(5, numPeople)
+    numSusceptible = numPeople - numInfectious
+    numRecovered = 0
+    # Loop through the number of days; people in a group are interchangeable, so the number who recover and the number who get infected are each a single binomial draw
+    for day in range(numDay):
+        numNewRecovered = int(rng.binomial(numInfectious, recoverProb))
+        numInfectious = numInfectious - numNewRecovered
+        numRecovered = numRecovered + numNewRecovered
+
+        infectProb = min(1.0, contactRate * numInfectious / numPeople)
+        numNewInfectious = int(rng.binomial(numSusceptible, infectProb))
+        numSusceptible = numSusceptible - numNewInfectious
+        numInfectious = numInfectious + numNewInfectious
+
+        yield [numSusceptible, numInfectious, numRecovered]
+        if numSusceptible == 0 or numInfectious == 0:
+            break
+
+# Binomial draws with a variance below this are found by searching the exact cumulative distribution; larger ones use its normal approximation
+COUPLED_EXACT_VARIANCE = 25
+
+# Coefficients of the rational approximations of the inverse of the standard normal cumulative distribution by P. J. Acklam, in the central region and in the tails
+NORMAL_QUANTILE_A = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+NORMAL_QUANTILE_B = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+NORMAL_QUANTILE_C = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+NORMAL_QUANTILE_D = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+# Probability below which the tail approximation is used
+NORMAL_QUANTILE_LOW = 0.02425
+
+def normalQuantile(probs):
+    '''
+    Computes the inverse of the standard normal cumulative distribution for a whole array at once, with a relative error below 1.2e-9
+
+    Parameters:
+    - probs (numpy.ndarray): probabilities strictly between 0 and 1
+
+    Returns:
+    - z (numpy.ndarray): the value below which a standard normal variable falls with each probability
+    '''
+    probs = np.asarray(probs, dtype = float)
+    # The distribution is symmetric, so the upper tail is the lower one with the sign flipped
+    lowerProbs = np.minimum(probs, 1 - probs)
+    z = np.empty(probs.shape)
+    central = lowerProbs >= NORMAL_QUANTILE_LOW
+    q = probs[central] - 0.5
+    r = q * q
+    a, b = NORMAL_QUANTILE_A, NORMAL_QUANTILE_B
+    z[central] = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+    tail = ~central
+    q = np.sqrt(-2 * np.log(lowerProbs[tail]))
+    c, d = NORMAL_QUANTILE_C, NORMAL_QUANTILE_D
+    lowerZ = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    z[tail] = np.where(probs[tail] < 0.5, lowerZ, -lowerZ)
+    return z
+
+def coupledBinomial(numTrials, prob, uniforms):
+    '''
+    Draws binomial counts by inverting their cumulative distribution at given uniform random numbers, so that the same numbers give close counts for close parameters
+
+    Parameters:
+    - numTrials (numpy.ndarray): number of trials of every draw
+    - prob (float or numpy.ndarray): probability of success of every draw
+    - uniforms (numpy.ndarray): one uniform random number in [0, 1) for every draw
+
+    Returns:
+    - counts (numpy.ndarray): the number of successes of every draw
+    '''
+    numTrials = np.asarray(numTrials, dtype = np.int64)
+    prob = np.broadcast_to(np.asarray(prob, dtype = float), numTrials.shape)
+    # Count failures instead of successes when successes are likely, so that the search below starts near the bulk of the distribution
+    flipped = prob > 0.5
+    prob = np.where(flipped, 1 - prob, prob)
+    uniforms = np.where(flipped, 1 - uniforms, uniforms)
+    mean = numTrials * prob
+    variance = mean * (1 - prob)
+    counts = np.zeros(numTrials.shape, dtype = np.int64)
+
+    # Walk up the probabilities of 0, 1, 2, ... successes until they add up to the uniform number
+    exact = (variance < COUPLED_EXACT_VARIANCE) & (prob > 0)
+    if exact.any():
+        trials, p, u = numTrials[exact], prob[exact], uniforms[exact]
+        count = np.zeros(trials.shape, dtype = np.int64)
+        pmf = np.exp(trials * np.log1p(-p))
+        cdf = pmf.copy()
+        ratio = p / (1 - p)
+        searching = (cdf <= u) & (count < trials)
+        while searching.any():
+            pmf = np.where(searching, pmf * (trials - count) / (count + 1) * ratio, pmf)
+            count = count + searching
+            cdf = np.where(searching, cdf + pmf, cdf)
+            searching = searching & (cdf <= u) & (count < trials)
+        counts[exact] = count
+
+    # A binomial distribution with a large variance is close to a normal one
+    approximate = ~exact & (prob > 0)
+    if approximate.any():
+        z = normalQuantile(np.clip(uniforms[approximate], 1e-12, 1 - 1e-12))
+        counts[approximate] = np.clip(np.floor(mean[approximate] + np.sqrt(variance[approximate]) * z + 0.5), 0, numTrials[approximate])
+
+    return np.where(flipped, numTrials - counts, counts)
+
+def coupledSteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the change in the population day by day, keeping only the number of people in each group and drawing exactly two random numbers a day, so that two scenarios given the same random stream stay in step
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    for stats in coupledBatchSteps(numDay, numPeople, recoverProb, contactRate, 1, rng):
+        yield stats[0].tolist()
+
+def recoveryRate(recoverProb):
+    '''
+    Turns the daily recovery probability into the rate of recovery in continuous time, at which the same fraction of infectious people recovers in a day
+
+    Parameters:
+    - recoverProb (float): probability of recovery in a time step
+
+    Returns:
+    - recoverRate (float): the rate of recovery of an infectious person per day
+    '''
+    # Everybody recovering within a day is an infinite rate; a very fast one is the same in practice
+    return -math.log1p(-recoverProb) if recoverProb < 1 else 1e3
+
+def gillespieSteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the epidemic in continuous time one event at a time (Gillespie's direct method), taking the count of each group at the end of every day
+
+    Infections happen at rate contactRate * S * I / numPeople and recoveries at rate recoveryRate(recoverProb) * I, so the time taken grows with the number of events rather than with the size of the population times the number of days.
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    recoverRate = recoveryRate(recoverProb)
+    numInfectious = min(5, numPeople)
+    numSusceptible = numPeople - numInfectious
+    numRecovered = 0
+    clock = 0.0
+    # Draw random numbers in chunks, as drawing them one by one costs more than the rest of an event
+    draws = []
+    for day in range(numDay):
+        while True:
+            infectRate = contactRate * numSusceptible * numInfectious / numPeople
+            totalRate = infectRate + recoverRate * numInfectious
+            if totalRate == 0:
+                break
+            if len(draws) < 2:
+                draws = rng.random(2048).tolist()
+            waitDraw, eventDraw = draws.pop(), draws.pop()
+            # Waiting times are memoryless, so an event that would come after the end of the day can be drawn again from there
+            wait = -math.log1p(-waitDraw) / totalRate
+            if clock + wait > day + 1:
+                break
+            clock = clock + wait
+            if eventDraw * totalRate < infectRate:
+                numSusceptible = numSusceptible - 1
+                numInfectious = numInfectious + 1
+            else:
+                numInfectious = numInfectious - 1
+                numRecovered = numRecovered + 1
+            if numSusceptible == 0 or numInfectious == 0:
+                break
+        clock = float(day + 1)
+        yield [numSusceptible, numInfectious, numRecovered]
+        if numSusceptible == 0 or numInfectious == 0:
+            break
+
+# Error allowed in the rates over one leap of tauLeapSteps, and the number of mean event times below which a leap is not worth it
+TAU_LEAP_EPSILON = 0.03
+TAU_LEAP_MIN_EVENTS = 10
+
+def tauLeapSteps(numDay, numPeople, recoverProb, contactRate, rng = None):
+    '''
+    Simulates the epidemic in continuous time, leaping over many events at once with a step chosen so that the rates barely change during it (adaptive tau-leaping), and taking the count of each group at the end of every day
+
+    The step follows Cao, Gillespie and Petzold (2006): the expected change and the variance of every group over a leap are bounded by TAU_LEAP_EPSILON times its size. When the step would cover fewer than TAU_LEAP_MIN_EVENTS events, single events are simulated exactly as in gillespieSteps.
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    recoverRate = recoveryRate(recoverProb)
+    numInfectious = min(5, numPeople)
+    numSusceptible = numPeople - numInfectious
+    numRecovered = 0
+    clock = 0.0
+    draws = []
+    for day in range(numDay):
+        while clock < day + 1 and numSusceptible > 0 and numInfectious > 0:
+            infectRate = contactRate * numSusceptible * numInfectious / numPeople
+            recoverEventRate = recoverRate * numInfectious
+            totalRate = infectRate + recoverEventRate
+            # Both groups take part in an infection, which needs one person of each, so their highest order of reaction is 2
+            boundSusceptible = max(TAU_LEAP_EPSILON * numSusceptible / 2, 1.0)
+            boundInfectious = max(TAU_LEAP_EPSILON * numInfectious / 2, 1.0)
+            driftInfectious = abs(infectRate - recoverEventRate)
+            tau = min(
+                boundSusceptible / infectRate if infectRate > 0 else math.inf,
+                boundSusceptible ** 2 / infectRate if infectRate > 0 else math.inf,
+                boundInfectious / driftInfectious if driftInfectious > 0 else math.inf,
+                boundInfectious ** 2 / totalRate,
+            )
+            if tau < TAU_LEAP_MIN_EVENTS / totalRate:
+                # Simulate a single event exactly, drawing the random numbers in chunks as in gillespieSteps
+                if len(draws) < 2:
+                    draws = rng.random(2048).tolist()
+                waitDraw, eventDraw = draws.pop(), draws.pop()
+                wait = -math.log1p(-waitDraw) / totalRate
+                if clock + wait > day + 1:
+                    break
+                clock = clock + wait
+                if eventDraw * totalRate < infectRate:
+                    numSusceptible, numInfectious = numSusceptible - 1, numInfectious + 1
+                else:
+                    numInfectious, numRecovered = numInfectious - 1, numRecovered + 1
+                continue
+            tau = min(tau, day + 1 - clock)
+            # Leap over a Poisson number of each event, halving the step if that would leave a group below zero
+            while True:
+                numNewInfectious = int(rng.poisson(infectRate * tau))
+                numNewRecovered = int(rng.poisson(recoverEventRate * tau))
+                if numNewInfectious <= numSusceptible and numNewRecovered <= numInfectious:
+                    break
+                tau = tau / 2
+            clock = clock + tau
+            numSusceptible = numSusceptible - numNewInfectious
+            numInfectious = numInfectious + numNewInfectious - numNewRecovered
+            numRecovered = numRecovered + numNewRecovered
+        clock = float(day + 1)
+        yield [numSusceptible, numInfectious, numRecovered]
+        if numSusceptible == 0 or numInfectious == 0:
+            break
+
+# Engines that can run a single simulation day by day, selected by name
+ENGINES = {
+    'list': listSteps,
+    'numpy': numpySteps,
+    # A single run of the SIR model is a loop over Python integers, about twice as fast as the scalar kernel of the compartmental models, which draws the same numbers
+    'binomial': binomialSteps,
+    'coupled': coupledSteps,
+    'gillespie': gillespieSteps,
+    'tauleap': tauLeapSteps,
+    'agents': agentSteps,
+    'seir': SEIR,
+    'sirs': SIRS,
+    'sirv': SIRV,
+}
+
+# The SIR model has no per-person attributes, so by default only the size of each group is simulated
+DEFAULT_ENGINE = 'binomial'
+
+def engineSteps(engine):
+    '''
+    Gets the function that runs a single simulation of an engine day by day
+
+    Parameters:
+    - engine (string or function): name of an engine in ENGINES, or a function with the same arguments as the engines in ENGINES, such as a network.NetworkEngine
+
+    Returns:
+    - steps (function): the function of the engine
+    '''
+    if callable(engine):
+        return engine
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine: " + str(engine))
+    return ENGINES[engine]
+
+def iterSimulation(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population over a period once, one day at a time
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulation
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - a generator of the count of susceptible, infectious and recovered people on each day of the simulation, which yields every day as soon as it is simulated
+    '''
+    numDaySimulated = 0
+    for stats in engineSteps(engine)(numDay, numPeople, recoverProb, contactRate, makeRng(seed)):
+        numDaySimulated = numDaySimulated + 1
+        yield stats
+    # If simulation ends early, repeat the last statistics for the remaining days
+    for day in range(numDaySimulated, numDay):
+        yield list(stats)
+
+def activeSimulation(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population over a period once, only up to the day the simulation ends
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulation
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - stats (list): a list of the daily count of susceptible, infectious and recovered people up to the day the simulation ends
+    - absorbedDay (int): the day, counting from 1, on which the number of susceptible or infectious people reached 0 so that the population stays the same afterwards, or None if that did not happen within numDay days
+    '''
+    stats = list(engineSteps(engine)(numDay, numPeople, recoverProb, contactRate, makeRng(seed)))
+    absorbedDay = len(stats) if stats and (stats[-1][0] == 0 or stats[-1][1] == 0) else None
+    return stats, absorbedDay
+
+def oneSimulation(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population over a period once
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulation
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - stats (list): a list of the daily count of susceptible, infectious and recovered people after the simulation
+    '''
+    stats, absorbedDay = activeSimulation(numDay, numPeople, recoverProb, contactRate, engine, seed)
+    # If simulation ends early, repeat the last statistics for the remaining days, as a separate list for every day
+    return stats + [list(stats[-1]) for day in range(len(stats), numDay)]
+
+def numpyBatchSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, rng = None):
+    '''
+    Simulates the change in the population day by day for many replicates at once, storing every person of every replicate as a status code in a NumPy array
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations to run
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of arrays of shape (numReplicates, 3) with the count of susceptible, infectious and recovered people in every simulation on each day, which stops early once every simulation has ended
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    # Make a (numReplicates, numPeople) array of initial populations with the same composition as initPopulation
+    population = np.full((numReplicates, numPeople), SUSCEPTIBLE, dtype = np.int8)
+    population[:, :min(5, numPeople)] = INFECTIOUS
+    numInfectious = np.full(numReplicates, min(5, numPeople), dtype = np.int64)
+    numSusceptible = numPeople - numInfectious
+    numRecovered = np.zeros(numReplicates, dtype = np.int64)
+    draws = np.empty((numReplicates, numPeople))
+    # Replicates where the number of susceptible or infectious people reached 0 stop changing, like a simulation that ends early
+    active = np.ones(numReplicates, dtype = bool)
+    for day in range(numDay):
+        rng.random(out = draws)
+        recovered = (population == INFECTIOUS) & (draws < recoverProb) & active[:, None]
+        population[recovered] = RECOVERED
+        numNewRecovered = np.count_nonzero(recovered, axis = 1)
+        numInfectious = numInfectious - numNewRecovered
+        numRecovered = numRecovered + numNewRecovered
+
+        rng.random(out = draws)
+        infected = (population == SUSCEPTIBLE) & (draws < (contactRate * numInfectious / numPeople)[:, None]) & active[:, None]
+        population[infected] = INFECTIOUS
+        numNewInfectious = np.count_nonzero(infected, axis = 1)
+        numSusceptible = numSusceptible - numNewInfectious
+        numInfectious = numInfectious + numNewInfectious
+
+        yield np.column_stack((numSusceptible, numInfectious, numRecovered))
+        active = active & (numSusceptible > 0) & (numInfectious > 0)
+        if not active.any():
+            break
+
+def coupledBatchSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, rng = None):
+    '''
+    Simulates the change in the population day by day for many replicates at once, drawing exactly two random numbers a day for every replicate so that the replicates of two scenarios given the same random stream stay in step
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations to run
+    - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+    Returns:
+    - a generator of arrays of shape (numReplicates, 3) with the count of susceptible, infectious and recovered people in every simulation on each day, which stops early once every simulation has ended
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    numInfectious = np.full(numReplicates, min(5, numPeople), dtype = np.int64)
+    numSusceptible = numPeople - numInfectious
+    numRecovered = np.zeros(numReplicates, dtype = np.int64)
+    active = np.ones(numReplicates, dtype = bool)
+    for day in range(numDay):
+        # Draw the numbers of every replicate even once it has ended, so that replicate k of any scenario always uses the same numbers on the same day
+        uniforms = rng.random((2, numReplicates))
+        numNewRecovered = np.where(active, coupledBinomial(numInfectious, recoverProb, uniforms[0]), 0)
+        numInfectious = numInfectious - numNewRecovered
+        numRecovered = numRecovered + numNewRecovered
+
+        infectProb = np.minimum(1.0, contactRate * numInfectious / numPeople)
+        numNewInfectious = np.where(active, coupledBinomial(numSusceptible, infectProb, uniforms[1]), 0)
+        numSusceptible = numSusceptible - numNewInfectious
+        numInfectious = numInfectious + numNewInfectious
+
+        yield np.column_stack((numSusceptible, numInfectious, numRecovered))
+        active = active & (numSusceptible > 0) & (numInfectious > 0)
+        if not active.any():
+            break
+
+# Engines that can run many simulations day by day as one batched computation, selected by name
+BATCH_ENGINES = {
+    'numpy': numpyBatchSteps,
+    # The SIR model run by the kernel of the compartmental models, which draws the same numbers as binomialSteps for every replicate
+    'binomial': SIR.batchSteps,
+    'coupled': coupledBatchSteps,
+    'seir': SEIR.batchSteps,
+    'sirs': SIRS.batchSteps,
+    'sirv': SIRV.batchSteps,
+}
+
+def batchSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population day by day for many replicates, until every simulation has ended
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations to run
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - a generator of arrays of shape (numReplicates, 3) with the count of susceptible, infectious and recovered people in every simulation on each day, which stops early once every simulation has ended
+    '''
+    steps = engineSteps(engine)
+    rng = makeRng(seed)
+    # Run every replicate in one computation if the engine supports it
+    if engine in BATCH_ENGINES:
+        yield from BATCH_ENGINES[engine](numDay, numPeople, recoverProb, contactRate, numReplicates, rng)
+        return
+    if isinstance(engine, CompartmentModel):
+        yield from engine.batchSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, rng)
+        return
+    # Otherwise, advance the replicates side by side; a replicate that has ended keeps its last statistics
+    simulations = [steps(numDay, numPeople, recoverProb, contactRate, rng) for num in range(numReplicates)]
+    stats = np.zeros((numReplicates, 3), dtype = np.int64)
+    for day in range(numDay):
+        for num in range(numReplicates):
+            if simulations[num] is not None:
+                try:
+                    stats[num] = next(simulations[num])
+                except StopIteration:
+                    simulations[num] = None
+        if all(simulation is None for simulation in simulations):
+            return
+        yield stats.copy()
+
+def iterBatch(numDay, numPeople, recoverProb, contactRate, numReplicates, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population over a period many times, one day at a time
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations to run
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - a generator of arrays of shape (numReplicates, 3) with the count of susceptible, infectious and recovered people in every simulation on each day
+    '''
+    numDaySimulated = 0
+    for stats in batchSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, engine, seed):
+        numDaySimulated = numDaySimulated + 1
+        yield stats
+    # If every simulation ends early, repeat the last statistics for the remaining days
+    for day in range(numDaySimulated, numDay):
+        yield stats.copy()
+
+def activeBatch(numDay, numPeople, recoverProb, contactRate, numReplicates, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population over a period many times, only up to the day the last simulation ends
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations to run
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDaySimulated, 3) with the daily count of susceptible, infectious and recovered people in every simulation up to the day the last simulation ends
+    - absorbedDays (numpy.ndarray): for every simulation, the day, counting from 1, on which the number of susceptible or infectious people reached 0, or numDay + 1 if that did not happen within numDay days
+    '''
+    days = list(batchSteps(numDay, numPeople, recoverProb, contactRate, numReplicates, engine, seed))
+    trajectories = np.stack(days, axis = 1) if days else np.empty((numReplicates, 0, 3), dtype = np.int64)
+    if trajectories.shape[1] == 0:
+        # Nothing was simulated, so no simulation ended
+        return trajectories, np.full(numReplicates, numDay + 1)
+    ended = (trajectories[:, :, 0] == 0) | (trajectories[:, :, 1] == 0)
+    absorbedDays = np.where(ended.any(axis = 1), ended.argmax(axis = 1) + 1, numDay + 1)
+    return trajectories, absorbedDays
+
+def batchSimulations(numDay, numPeople, recoverProb, contactRate, numReplicates, engine = DEFAULT_ENGINE, seed = None):
+    '''
+    Simulates the change in the population over a period many times
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations to run
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+
+    Returns:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    '''
+    active, absorbedDays = activeBatch(numDay, numPeople, recoverProb, contactRate, numReplicates, engine, seed)
+    numDaySimulated = active.shape[1]
+    trajectories = np.empty((numReplicates, numDay, 3), dtype = np.int64)
+    trajectories[:, :numDaySimulated] = active
+    # Every simulation has ended by the last simulated day, so the remaining days all repeat it; fill them in one step
+    if 0 < numDaySimulated < numDay:
+        trajectories[:, numDaySimulated:] = active[:, -1:]
+    return trajectories
+
+# Number of replicates that share one random stream, by engine; replicates are handed to worker processes in whole blocks so the results do not depend on the number of workers
+# Engines that store every person spend most of their time on each replicate, so their blocks hold a single replicate
+REPLICATE_BLOCKS = {
+    'binomial': 64,
+    'coupled': 64,
+    'seir': 64,
+    'sirs': 64,
+    'sirv': 64,
+}
+
+# Process pools that are kept between calls, by number of workers
+executors = {}
+
+def getExecutor(numWorkers):
+    '''
+    Gets a process pool with the given number of workers, starting it the first time it is needed
+
+    Parameters:
+    - numWorkers (int): number of worker processes
+
+    Returns:
+    - executor (concurrent.futures.ProcessPoolExecutor): a process pool with numWorkers workers
+    '''
+    if numWorkers not in executors:
+        executors[numWorkers] = ProcessPoolExecutor(max_workers = numWorkers)
+    return executors[numWorkers]
+
+def scenarioSeedSequence(seed, numDay, numPeople, recoverProb, contactRate):
+    '''
+    Derives the random stream of a scenario from a seed and the parameters of the scenario, so that different scenarios run with the same seed are independent
+
+    Parameters:
+    - seed (int or numpy.random.Generator): seed of the random streams, or a random number generator to draw it from; fresh entropy from the operating system if None
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+
+    Returns:
+    - seedSequence (numpy.random.SeedSequence): the seed sequence of the scenario
+    '''
+    digest = hashlib.sha256(repr((numDay, numPeople, float(recoverProb), float(contactRate))).encode()).digest()
+    spawnKey = tuple(int.from_bytes(digest[index:index + 4], 'little') for index in range(0, 16, 4))
+    return np.random.SeedSequence(seedEntropy(seed), spawn_key = spawnKey)
+
+def replicateBlocks(scenario, engine, numReplicates, seed, paired = False):
+    '''
+    Splits the replicates of a scenario into blocks, each with its own random stream
+
+    Parameters:
+    - scenario (tuple): the (numDay, numPeople, recoverProb, contactRate) of the scenario
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations of the scenario
+    - seed (int or numpy.random.Generator): seed of the random streams, or a random number generator to draw it from
+    - paired (bool): if True, the streams only depend on the seed, so that every scenario run with the same seed gets the same streams
+
+    Returns:
+    - blocks (list): a list of (numReplicates, seedSequence) pairs with the number of simulations of every block and the seed sequence of its random stream
+    '''
+    # A compartmental model counts people, like the binomial engine, so its replicates are cheap enough to share blocks
+    blockSize = REPLICATE_BLOCKS['binomial'] if isinstance(engine, CompartmentModel) else REPLICATE_BLOCKS.get(engine, 1)
+    numBlocks = -(-numReplicates // blockSize)
+    seedSequence = np.random.SeedSequence(seedEntropy(seed)) if paired else scenarioSeedSequence(seed, *scenario)
+    blockSeeds = seedSequence.spawn(numBlocks)
+    return [(min(blockSize, numReplicates - index * blockSize), blockSeeds[index]) for index in range(numBlocks)]
+
+def runBlock(numDay, numPeople, recoverProb, contactRate, numReplicates, engine, seedSequence):
+    '''
+    Runs one block of replicates with its own random stream; this is the unit of work given to a worker process
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - numReplicates (int): number of simulations in the block
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - seedSequence (numpy.random.SeedSequence): seed sequence of the random stream of the block
+
+    Returns:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    '''
+    return batchSimulations(numDay, numPeople, recoverProb, contactRate, numReplicates, engine, np.random.default_rng(seedSequence))
+
+def runScenarios(scenarios, engine = DEFAULT_ENGINE, numReplicates = 5, seed = None, numWorkers = 1, progress = None, paired = False):
+    '''
+    Simulates several scenarios many times, splitting the replicates of every scenario into blocks that run in a process pool
+
+    Parameters:
+    - scenarios (list): a list of (numDay, numPeople, recoverProb, contactRate) tuples
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations of each scenario
+    - seed (int or numpy.random.Generator): seed of the random streams, or a random number generator to draw it from; the results are the same for the same seed whatever the number of workers
+    - numWorkers (int): number of worker processes; the simulations run in the current process if 1
+    - progress (function): function called with the fraction of the simulations that are done every time a block finishes
+    - paired (bool): if True, replicate k of every scenario is driven by the same random stream (common random numbers), so that the differences between scenarios vary less than their results
+
+    Returns:
+    - results (list): for every scenario, an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    '''
+    numBlocks, finished = finishedBlocks(scenarios, engine, numReplicates, seed, numWorkers, paired)
+    # Put the blocks back in order as they finish, reporting the fraction of blocks done
+    results = [[None] * numBlocks for scenario in scenarios]
+    with instrumentation.timer('simulate'):
+        for numFinished, (scenarioIndex, blockIndex, start, trajectories) in enumerate(finished, 1):
+            results[scenarioIndex][blockIndex] = trajectories
+            if progress is not None:
+                progress(numFinished / (numBlocks * len(scenarios)))
+        results = [np.concatenate(scenarioResults) for scenarioResults in results]
+    if instrumentation.enabled:
+        countSimulations(scenarios, results)
+    return results
+
+def finishedBlocks(scenarios, engine, numReplicates, seed, numWorkers, paired = False):
+    '''
+    Runs the blocks of replicates of several scenarios, in a process pool if there is more than one worker, and yields them as they finish
+
+    Parameters:
+    - scenarios, engine, numReplicates, seed, numWorkers, paired: as for runScenarios
+
+    Returns:
+    - numBlocks (int): number of blocks of every scenario
+    - finished (generator): a generator of (scenarioIndex, blockIndex, start, trajectories) tuples, where start is the index of the first replicate of the block and trajectories the array of shape (numBlockReplicates, numDay, 3) of the block
+    '''
+    # Split the replicates of every scenario into blocks, each with its own random stream; a generator given as the seed is only drawn from once
+    seed = seedEntropy(seed)
+    # Paired scenarios must share their entropy even without a seed
+    if paired and seed is None:
+        seed = np.random.SeedSequence().entropy
+    blocks = [[(*scenario, numBlockReplicates, engine, blockSeed) for numBlockReplicates, blockSeed in replicateBlocks(scenario, engine, numReplicates, seed, paired)] for scenario in scenarios]
+    numBlocks = len(blocks[0]) if blocks else 0
+    # Every block but the last has the same size, so the first replicate of a block follows from its index
+    blockSize = blocks[0][0][4] if numBlocks else 0
+    # Run the blocks of all scenarios in the process pool, or one after another if there is a single worker
+    if numWorkers > 1:
+        executor = getExecutor(numWorkers)
+        futures = {executor.submit(runBlock, *block): (scenarioIndex, blockIndex) for scenarioIndex, scenarioBlocks in enumerate(blocks) for blockIndex, block in enumerate(scenarioBlocks)}
+        finished = (futures[future] + (future.result(),) for future in as_completed(futures))
+    else:
+        finished = ((scenarioIndex, blockIndex, runBlock(*block)) for scenarioIndex, scenarioBlocks in enumerate(blocks) for blockIndex, block in enumerate(scenarioBlocks))
+    return numBlocks, ((scenarioIndex, blockIndex, blockIndex * blockSize, trajectories) for scenarioIndex, blockIndex, trajectories in finished)
+
+def countSimulations(scenarios, results):
+    '''
+    Adds the work done by simulations to the instrumentation counters: the replicates, the person-days simulated up to the day each replicate ended, and the replicates that ended early
+
+    Parameters:
+    - scenarios (list): a list of (numDay, numPeople, recoverProb, contactRate) tuples
+    - results (list): for every scenario, an array of shape (numReplicates, numDay, 3) as returned by runScenarios
+    '''
+    for (numDay, numPeople, recoverProb, contactRate), trajectories in zip(scenarios, results):
+        if trajectories.shape[1] == 0:
+            # Nothing was simulated, so no simulation ended early
+            instrumentation.count('replicates', len(trajectories))
+            continue
+        ended = (trajectories[:, :, 0] == 0) | (trajectories[:, :, 1] == 0)
+        endedEarly = ended.any(axis = 1)
+        daysSimulated = np.where(endedEarly, ended.argmax(axis = 1) + 1, numDay)
+        instrumentation.count('replicates', len(trajectories))
+        instrumentation.count('early_terminations', int(np.count_nonzero(endedEarly & (daysSimulated < numDay))))
+        instrumentation.count('person_days', int(daysSimulated.sum()) * numPeople)
+
+def iterScenario(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, numReplicates = 5, seed = None):
+    '''
+    Simulates a scenario many times, one day at a time, with the same random streams as runScenarios
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations
+    - seed (int or numpy.random.Generator): seed of the random streams, or a random number generator to draw it from
+
+    Returns:
+    - a generator of arrays of shape (numReplicates, 3) with the count of susceptible, infectious and recovered people in every simulation on each day
+    '''
+    # Advance every block of replicates by one day in turn so that each day is available as soon as it is simulated
+    steps = [iterBatch(numDay, numPeople, recoverProb, contactRate, numBlockReplicates, engine, np.random.default_rng(blockSeed)) for numBlockReplicates, blockSeed in replicateBlocks((numDay, numPeople, recoverProb, contactRate), engine, numReplicates, seed)]
+    for day in zip(*steps):
+        yield np.concatenate(day)
+
+def iterAverageStats(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, numReplicates = 5, seed = None):
+    '''
+    Simulates the change in the population over a period multiple times, yielding the average of each day as soon as it is simulated
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs each simulation
+    - numReplicates (int): number of simulations to average over
+    - seed (int or numpy.random.Generator): seed of the random streams, or a random number generator to draw it from; the averages are the same as those of multipleSimulations with the same seed
+
+    Returns:
+    - a generator of the average count of susceptible, infectious and recovered people and the average fraction of infectious people on each day
+    '''
+    for stats in iterScenario(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed):
+        mean = stats.mean(axis = 0)
+        yield [float(mean[0]), float(mean[1]), float(mean[2]), float(mean[1]) / numPeople]
+
+def averageStats(trajectories, numPeople):
+    '''
+    Averages the daily population composition over many simulations
+
+    Parameters:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    - numPeople (int): number of people in a population
+
+    Returns:
+    - averageDailyStats (list): a list of the average daily count of susceptible, infectious and recovered people and the average fraction of infectious people
+    '''
+    # Average every day over the replicates and add the fraction of infectious people as a fourth column
+    with instrumentation.timer('average'):
+        mean = trajectories.mean(axis = 0)
+        averageDailyStats = np.column_stack((mean, mean[:, 1] / numPeople))
+        return averageDailyStats.tolist()
+
+def meanFieldSteps(numDay, numPeople, recoverProb, contactRate):
+    '''
+    Computes the expected change in the population day by day with the same daily steps as the stochastic engines, which large populations follow closely
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+
+    Returns:
+    - a generator of the expected daily count of susceptible, infectious and recovered people
+    '''
+    numInfectious = float(min(5, numPeople))
+    numSusceptible = numPeople - numInfectious
+    numRecovered = 0.0
+    # Each day, the infectious people recover first and the remaining ones then infect the susceptible people, as in recover and infect
+    for day in range(numDay):
+        numNewRecovered = numInfectious * recoverProb
+        numInfectious = numInfectious - numNewRecovered
+        numRecovered = numRecovered + numNewRecovered
+
+        numNewInfectious = numSusceptible * min(1.0, contactRate * numInfectious / numPeople)
+        numSusceptible = numSusceptible - numNewInfectious
+        numInfectious = numInfectious + numNewInfectious
+
+        yield [numSusceptible, numInfectious, numRecovered]
+
+# Coefficients of the Dormand-Prince pair of Runge-Kutta methods of order 5 and 4
+DORMAND_PRINCE_STAGES = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+DORMAND_PRINCE_WEIGHTS = [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0]
+DORMAND_PRINCE_ERRORS = [71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40]
+
+def rk45Steps(numDay, numPeople, recoverProb, contactRate, tolerance = 1e-6):
+    '''
+    Integrates the differential equations of the SIR model with an adaptive Runge-Kutta method (Dormand-Prince), giving the count of each group at the end of every day
+
+    The daily recovery probability is turned into a rate by recoveryRate, and the contact rate is used as the daily rate of infection, as in gillespieSteps.
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - tolerance (float): relative error allowed in every step, as a fraction of the population
+
+    Returns:
+    - a generator of the daily count of susceptible, infectious and recovered people
+    '''
+    recoverRate = recoveryRate(recoverProb)
+
+    def derivative(numSusceptible, numInfectious):
+        numNewInfectious = contactRate * numSusceptible * numInfectious / numPeople
+        return -numNewInfectious, numNewInfectious - recoverRate * numInfectious
+
+    # The population stays the same, so only the susceptible and infectious people are integrated
+    numInfectious = float(min(5, numPeople))
+    numSusceptible = numPeople - numInfectious
+    scale = tolerance * max(numPeople, 1)
+    step = 0.1
+    for day in range(numDay):
+        clock = 0.0
+        # Take adaptive steps until the end of the day, shortening the last one to land on it
+        while clock < 1.0:
+            step = min(step, 1.0 - clock)
+            slopes = []
+            for stage in DORMAND_PRINCE_STAGES:
+                pointSusceptible, pointInfectious = numSusceptible, numInfectious
+                for weight, (slopeSusceptible, slopeInfectious) in zip(stage, slopes):
+                    pointSusceptible = pointSusceptible + step * weight * slopeSusceptible
+                    pointInfectious = pointInfectious + step * weight * slopeInfectious
+                slopes.append(derivative(pointSusceptible, pointInfectious))
+            # Estimate the error of the step from the difference between the methods of order 5 and 4
+            errorSusceptible = errorInfectious = 0.0
+            for weight, (slopeSusceptible, slopeInfectious) in zip(DORMAND_PRINCE_ERRORS, slopes):
+                errorSusceptible = errorSusceptible + weight * slopeSusceptible
+                errorInfectious = errorInfectious + weight * slopeInfectious
+            error = step * max(abs(errorSusceptible), abs(errorInfectious), abs(errorSusceptible + errorInfectious)) / scale
+            if error <= 1.0:
+                clock = clock + step
+                for weight, (slopeSusceptible, slopeInfectious) in zip(DORMAND_PRINCE_WEIGHTS, slopes):
+                    numSusceptible = numSusceptible + step * weight * slopeSusceptible
+                    numInfectious = numInfectious + step * weight * slopeInfectious
+            # Grow or shrink the next step with the usual safety factor, within bounds
+            step = step * min(5.0, max(0.2, 0.9 * max(error, 1e-10) ** -0.2))
+        yield [numSusceptible, numInfectious, numPeople - numSusceptible - numInfectious]
+
+# Deterministic engines, which compute the mean-field limit of the model once instead of averaging simulations, selected by name
+DETERMINISTIC_ENGINES = {
+    'meanfield': meanFieldSteps,
+    'rk45': rk45Steps,
+}
+
+def deterministicStats(numDay, numPeople, recoverProb, contactRate, engine = 'meanfield'):
+    '''
+    Computes the daily population composition of the mean-field limit of the model, in the same form as multipleSimulations
 
     Parameters:
+    - numDay (int): number of days over which the simulation takes place
     - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string): name of the engine in DETERMINISTIC_ENGINES; 'meanfield' follows the daily steps of the stochastic engines exactly, and 'rk45' integrates the differential equations in continuous time
 
     Returns:
-    - population (list): a list of people in a population
+    - dailyStats (list): a list of the daily count of susceptible, infectious and recovered people and the fraction of infectious people
     '''
-    # Create a population with 5 intial infectious people
-    population = ['infectious'] * 5 + ['susceptible'] * (numPeople - 5)
-    return population
+    if engine not in DETERMINISTIC_ENGINES:
+        raise ValueError("Unknown engine: " + str(engine))
+    return [[numSusceptible, numInfectious, numRecovered, numInfectious / numPeople] for numSusceptible, numInfectious, numRecovered in DETERMINISTIC_ENGINES[engine](numDay, numPeople, recoverProb, contactRate)]
 
-def recover(population, recoverProb):
+def multipleSimulations(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, numReplicates = 5, seed = None, numWorkers = 1, progress = None, trajectoryFile = None):
     '''
-    Modifies the population after some people recover
+    Simulates the change in the population over a period multiple times
 
     Parameters:
-    - population (list): a list of people in a population
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
     - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs each simulation; the name of an engine in DETERMINISTIC_ENGINES computes the mean-field limit instead
+    - numReplicates (int): number of simulations to average over
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+    - trajectoryFile (string): if given, the trajectory of every replicate is also written to this .npy file by storeTrajectories, for openTrajectories to reopen later, and the average is computed from the file
 
     Returns:
-    - newpopulation (list): a list of people in a population after some recover
+    - averageDailyStats (list): a list of the average daily count of susceptible, infectious and recovered people and the average fraction of infectious people
     '''
-    # Assign to newpopulation an empty list
-    newpopulation = []
-    # Add to the newpopulation list a recovered person if the person is infectious and recovers; otherwise, add a person with the current status
-    for person in population:
-        if person == 'infectious' and random.random() < recoverProb:
-            newpopulation.append('recovered')
-        else:
-            newpopulation.append(person)
-    return newpopulation
+    # A deterministic engine gives the average directly, without random numbers or replicates
+    if engine in DETERMINISTIC_ENGINES:
+        return deterministicStats(numDay, numPeople, recoverProb, contactRate, engine)
+    # Keeping the trajectories needs them simulated, even if their average is cached
+    if trajectoryFile is not None:
+        trajectories = storeTrajectories(numDay, numPeople, recoverProb, contactRate, trajectoryFile, engine, numReplicates, seed, numWorkers, progress)
+        averageDailyStats = trajectoryAverage(trajectories, numPeople)
+        cacheStats(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed, averageDailyStats)
+        return averageDailyStats
+    # Results with an integer seed are reproducible, so look them up in the cache before simulating; the number of workers does not change the results
+    averageDailyStats = cachedStats(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed)
+    if averageDailyStats is not None:
+        return averageDailyStats
+    trajectories = runScenarios([(numDay, numPeople, recoverProb, contactRate)], engine, numReplicates, seed, numWorkers, progress)[0]
+    averageDailyStats = averageStats(trajectories, numPeople)
+    cacheStats(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed, averageDailyStats)
+    return averageDailyStats
 
-def infect(population, contactRate):
+def statsKey(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed):
     '''
-    Modifies the population after some people get infected
+    Gets the cache key of the average daily statistics of a scenario
 
     Parameters:
-    - population (list): a list of people in a population
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
     - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): engine that runs the simulations
+    - numReplicates (int): number of simulations averaged over
+    - seed (int): seed of the random streams
 
     Returns:
-    - newpopulation (list): a list of people in a population after some get infected
+    - key (string): the cache key, or None if the results are not reproducible
     '''
-    # Assign to newpopulation an empty list
-    newpopulation = []
-    # Count the number of infectious people
-    numInfectious = population.count('infectious')
-    # Append to the newpopulation list an infectious person if the person is susceptible and get infected; otherwise, add a person with the current status
-    for person in population:
-        if person == 'susceptible' and random.random() < contactRate * numInfectious / len(population):
-            newpopulation.append('infectious')
-        else:
-            newpopulation.append(person)
-    return newpopulation
+    if not isReproducible(seed):
+        return None
+    return cacheKey('multipleSimulations', numDay, numPeople, float(recoverProb), float(contactRate), numReplicates, seed, engine, ENGINE_VERSION)
 
-def oneSimulation(numDay, numPeople, recoverProb, contactRate):
+def cachedStats(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed):
     '''
-    Simulates the change in the population over a period once
+    Looks up the average daily statistics of a scenario stored by cacheStats
+
+    Parameters:
+    - numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed: as for statsKey
+
+    Returns:
+    - averageDailyStats (list): the statistics as returned by multipleSimulations, or None if they are not cached
+    '''
+    key = statsKey(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed)
+    cached = resultCache.get(key) if key is not None else None
+    if cached is None:
+        return None
+    return np.load(io.BytesIO(cached)).tolist()
+
+def cacheStats(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed, averageDailyStats):
+    '''
+    Stores the average daily statistics of a seeded scenario as a NumPy array, about 32 bytes a day, so that the graphs of the scenario and every comparison with it can reuse them
+
+    Parameters:
+    - numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed: as for statsKey
+    - averageDailyStats (list): the statistics as returned by multipleSimulations
+    '''
+    key = statsKey(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed)
+    if key is not None:
+        buffer = io.BytesIO()
+        np.save(buffer, np.array(averageDailyStats))
+        resultCache.set(key, buffer.getvalue())
+
+# Seconds after which the adaptive mode starts no new batch of replicates, if no time budget is given
+ADAPTIVE_TIME_BUDGET = 10.0
+
+def adaptiveSimulations(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, tolerance = 0.01, timeBudget = ADAPTIVE_TIME_BUDGET, confidence = 0.95, seed = None, numWorkers = 1, maxReplicates = 100000):
+    '''
+    Simulates a scenario in batches of replicates until the confidence intervals of the peak number of infectious people and of the final fraction of recovered people are narrow enough, or the time budget runs out
+
+    The first batch has 5 replicates, as multipleSimulations. Each next batch has as many replicates as the spread of the ones so far says are needed to reach the tolerance, but no more than all the previous batches together, so that a poor estimate of the spread is corrected soon, nor more than fit in the time left.
+    Only the daily totals and the two outputs of every replicate are kept, so the memory taken does not grow with the number of days times the number of replicates.
 
     Parameters:
     - numDay (int): number of days over which the simulation takes place
     - numPeople (int): number of people in a population
     - recoverProb (float): probability of recovery in a time step
     - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations; the name of an engine in DETERMINISTIC_ENGINES computes the mean-field limit, which is exact
+    - tolerance (float): largest half-width of both confidence intervals, as a fraction of the population
+    - timeBudget (float): seconds after which no new batch is started
+    - confidence (float): confidence level of the intervals, between 0 and 1
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from; the number of replicates still depends on the time budget when it runs out, so such results are not cached
+    - numWorkers (int): number of worker processes that share the simulations
+    - maxReplicates (int): largest number of replicates
 
     Returns:
-    - newpopulation (list): a list of people in a population with updated statuses after the simulation
+    - result (dict): the average daily statistics as returned by multipleSimulations ('stats'), the number of replicates run ('numReplicates'), the mean and the half-width of the confidence interval of the peak number of infectious people ('peakInfections') and of the final fraction of recovered people ('finalRecovered'), whether both half-widths are within the tolerance ('converged') and the time taken in seconds ('seconds')
     '''
-    # Make a list of initial population
-    population = initPopulation(numPeople)
-    stats = []
-    # Loop through the number of days to change the statuses of people in the population if applicable; if the number of susceptible or infectious people reaches 0, simulation ends early
-    for day in range(numDay):
-        population = recover(population, recoverProb)
-        population = infect(population, contactRate)
-        stats.append([population.count('susceptible'), population.count('infectious'), population.count('recovered')])
-        if population.count('susceptible') == 0:
-            break
-        elif population.count('infectious') == 0:
+    if not tolerance > 0:
+        raise ValueError("The tolerance must be positive")
+    start = time.perf_counter()
+    if engine in DETERMINISTIC_ENGINES:
+        stats = deterministicStats(numDay, numPeople, recoverProb, contactRate, engine)
+        return {
+            'stats': stats,
+            'numReplicates': 0,
+            'peakInfections': [max(day[1] for day in stats), 0.0],
+            'finalRecovered': [stats[-1][2] / numPeople, 0.0],
+            'converged': True,
+            'seconds': time.perf_counter() - start,
+        }
+    # Results with an integer seed are reproducible, so look them up in the cache before simulating
+    key = cacheKey('adaptiveSimulations', numDay, numPeople, float(recoverProb), float(contactRate), float(tolerance), float(timeBudget), float(confidence), seed, engine, maxReplicates, ENGINE_VERSION) if isReproducible(seed) else None
+    cached = resultCache.get(key) if key is not None else None
+    if cached is not None:
+        return json.loads(cached)
+
+    # Every batch draws the seed of its streams from one generator, so the batches are independent and the same seed gives the same batches
+    rng = np.random.default_rng(np.random.SeedSequence(seedEntropy(seed)))
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    totals = np.zeros((numDay, 3))
+    peaks = np.empty(0)
+    finals = np.empty(0)
+    batchSize = 5
+    while True:
+        batchStart = time.perf_counter()
+        trajectories = runScenarios([(numDay, numPeople, recoverProb, contactRate)], engine, batchSize, rng, numWorkers)[0]
+        secondsPerReplicate = (time.perf_counter() - batchStart) / batchSize
+        totals += trajectories.sum(axis = 0)
+        peaks = np.concatenate((peaks, trajectories[:, :, 1].max(axis = 1) / numPeople))
+        finals = np.concatenate((finals, trajectories[:, -1, 2] / numPeople))
+        numReplicates = len(peaks)
+        # Half-widths of the normal confidence intervals of the two means, as fractions of the population
+        halfWidth = max(z * peaks.std(ddof = 1), z * finals.std(ddof = 1)) / math.sqrt(numReplicates)
+        converged = bool(halfWidth <= tolerance)
+        numFitting = int((timeBudget - (time.perf_counter() - start)) / max(secondsPerReplicate, 1e-9))
+        if converged or numFitting < 1 or numReplicates >= maxReplicates:
             break
-    # If simulation ends early, repeat the last statistics for the remaining days
-    while len(stats) < numDay:
-        stats.append(stats[-1])
-    return stats
+        # The half-width shrinks with the square root of the number of replicates
+        numNeeded = math.ceil(numReplicates * (halfWidth / tolerance) ** 2) - numReplicates
+        batchSize = max(1, min(numNeeded, numReplicates, numFitting, maxReplicates - numReplicates))
 
-def multipleSimulations(numDay, numPeople, recoverProb, contactRate):
+    mean = totals / numReplicates
+    result = {
+        'stats': np.column_stack((mean, mean[:, 1] / numPeople)).tolist(),
+        'numReplicates': numReplicates,
+        'peakInfections': [float(peaks.mean() * numPeople), float(z * peaks.std(ddof = 1) / math.sqrt(numReplicates) * numPeople)],
+        'finalRecovered': [float(finals.mean()), float(z * finals.std(ddof = 1) / math.sqrt(numReplicates))],
+        'converged': converged,
+        'seconds': time.perf_counter() - start,
+    }
+    # A result that did not converge depends on how fast the batches ran, so only converged ones are reproducible
+    if key is not None and converged:
+        resultCache.set(key, json.dumps(result).encode())
+    return result
+
+def simulationBands(numDay, numPeople, recoverProb, contactRate, engine = DEFAULT_ENGINE, numReplicates = 1000, percentiles = (2.5, 50, 97.5), seed = None, numWorkers = 1):
     '''
-    Simulates the change in the population over a period multiple times
+    Summarizes the spread of the daily population composition over many simulations
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations to summarize
+    - percentiles (tuple): percentiles to compute for every day, between 0 and 100
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+
+    Returns:
+    - bands (dict): 'mean' and 'std' arrays of shape (numDay, 3) with the mean and standard deviation of the daily count of susceptible, infectious and recovered people, and 'percentiles', a dictionary from each percentile to an array of the same shape
+    '''
+    trajectories = runScenarios([(numDay, numPeople, recoverProb, contactRate)], engine, numReplicates, seed, numWorkers)[0]
+    quantiles = np.percentile(trajectories, percentiles, axis = 0)
+    return {
+        'mean': trajectories.mean(axis = 0),
+        'std': trajectories.std(axis = 0),
+        'percentiles': dict(zip(percentiles, quantiles)),
+    }
+
+# Replicates of a trajectory file reduced at once, and bytes of it read at once when every replicate of a day is needed; both bound the memory taken by a reduction
+TRAJECTORY_CHUNK_REPLICATES = 1024
+TRAJECTORY_CHUNK_BYTES = 64 * 1024 * 1024
+
+def storeTrajectories(numDay, numPeople, recoverProb, contactRate, path, engine = DEFAULT_ENGINE, numReplicates = 1000, seed = None, numWorkers = 1, progress = None):
+    '''
+    Simulates a scenario many times and writes the trajectory of every replicate into a memory-mapped .npy file as its block finishes, so that no more than a few blocks are ever in memory
+
+    The file holds the same array as runScenarios returns for the same seed, as 32-bit integers, or 64-bit integers for populations that do not fit in them.
 
     Parameters:
     - numDay (int): number of days over which the simulation takes place
     - numPeople (int): number of people in a population
     - recoverProb (float): probability of recovery in a time step
     - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - path (string): path of the .npy file to write
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - progress (function): function called with the fraction of the simulations that are done every time a block finishes
+
+    Returns:
+    - trajectories (numpy.memmap): the array of shape (numReplicates, numDay, 3) mapped from the file, with the daily count of susceptible, infectious and recovered people in every simulation
+    '''
+    dtype = np.int32 if numPeople <= np.iinfo(np.int32).max else np.int64
+    trajectories = np.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = (numReplicates, numDay, 3))
+    numBlocks, finished = finishedBlocks([(numDay, numPeople, recoverProb, contactRate)], engine, numReplicates, seed, numWorkers)
+    with instrumentation.timer('simulate'):
+        for numFinished, (scenarioIndex, blockIndex, start, block) in enumerate(finished, 1):
+            trajectories[start:start + len(block)] = block
+            if progress is not None:
+                progress(numFinished / numBlocks)
+    trajectories.flush()
+    if instrumentation.enabled:
+        instrumentation.count('replicates', numReplicates)
+    return trajectories
+
+def openTrajectories(path):
+    '''
+    Opens a trajectory file written by storeTrajectories without reading it into memory; its pages are read when they are used and shared between the processes that open it
+
+    Parameters:
+    - path (string): path of the .npy file
+
+    Returns:
+    - trajectories (numpy.memmap): the read-only array of shape (numReplicates, numDay, 3) mapped from the file
+    '''
+    return np.load(path, mmap_mode = 'r')
+
+def trajectoryAverage(trajectories, numPeople, chunkReplicates = TRAJECTORY_CHUNK_REPLICATES):
+    '''
+    Averages the daily population composition over the replicates of a trajectory array, such as one opened by openTrajectories, a chunk of replicates at a time
+
+    Parameters:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    - numPeople (int): number of people in a population
+    - chunkReplicates (int): number of replicates read at once
+
+    Returns:
+    - averageDailyStats (list): the same list as averageStats returns for the array
+    '''
+    totals = np.zeros(trajectories.shape[1:])
+    for start in range(0, len(trajectories), chunkReplicates):
+        totals += trajectories[start:start + chunkReplicates].sum(axis = 0, dtype = np.float64)
+    mean = totals / len(trajectories)
+    return np.column_stack((mean, mean[:, 1] / numPeople)).tolist()
+
+def trajectoryMetrics(trajectories, numPeople, chunkReplicates = TRAJECTORY_CHUNK_REPLICATES):
+    '''
+    Computes the summary metrics of a trajectory array, such as one opened by openTrajectories, a chunk of replicates at a time
+
+    Parameters:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    - numPeople (int): number of people in a population
+    - chunkReplicates (int): number of replicates read at once
+
+    Returns:
+    - metrics (dict): the same metrics as summaryMetrics returns for the array
+    '''
+    peakInfections = peakDay = finalSusceptible = 0.0
+    for start in range(0, len(trajectories), chunkReplicates):
+        numInfectious = trajectories[start:start + chunkReplicates, :, 1]
+        peakInfections += float(numInfectious.max(axis = 1).sum(dtype = np.float64))
+        peakDay += float((numInfectious.argmax(axis = 1) + 1).sum(dtype = np.float64))
+        finalSusceptible += float(trajectories[start:start + chunkReplicates, -1, 0].sum(dtype = np.float64))
+    numReplicates = len(trajectories)
+    return {
+        'peakInfections': peakInfections / numReplicates,
+        'peakDay': peakDay / numReplicates,
+        'finalAttackRate': (numPeople - finalSusceptible / numReplicates) / numPeople,
+    }
+
+def trajectoryBands(trajectories, percentiles = (2.5, 50, 97.5), chunkBytes = TRAJECTORY_CHUNK_BYTES):
+    '''
+    Summarizes the spread of the daily population composition in a trajectory array, such as one opened by openTrajectories; the percentiles of a day need every replicate, so the array is read a range of days at a time
+
+    Parameters:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    - percentiles (tuple): percentiles to compute for every day, between 0 and 100
+    - chunkBytes (int): bytes of the array, counted as 64-bit numbers, read at once
+
+    Returns:
+    - bands (dict): the same 'mean', 'std' and 'percentiles' as simulationBands returns for the array
+    '''
+    numReplicates, numDay = trajectories.shape[:2]
+    chunkDays = max(1, chunkBytes // (numReplicates * 3 * 8))
+    mean = np.empty((numDay, 3))
+    std = np.empty((numDay, 3))
+    quantiles = np.empty((len(percentiles), numDay, 3))
+    for start in range(0, numDay, chunkDays):
+        chunk = np.asarray(trajectories[:, start:start + chunkDays], dtype = np.float64)
+        mean[start:start + chunkDays] = chunk.mean(axis = 0)
+        std[start:start + chunkDays] = chunk.std(axis = 0)
+        quantiles[:, start:start + chunkDays] = np.percentile(chunk, percentiles, axis = 0)
+    return {
+        'mean': mean,
+        'std': std,
+        'percentiles': dict(zip(percentiles, quantiles)),
+    }
+
+def pairedComparison(oldScenario, newScenario, engine = 'coupled', numReplicates = 50, confidence = 0.95, seed = None, numWorkers = 1, progress = None):
+    '''
+    Compares two scenarios with common random numbers: replicate k of both scenarios is driven by the same random stream, and the difference is estimated from the paired replicates
+
+    The 'coupled' engine draws a fixed amount of random numbers every day, so paired replicates stay in step and their difference varies far less than with independent replicates.
+    The per-person 'numpy' engine is also coupled, as every person draws from the same position of the stream in both scenarios.
+
+    Parameters:
+    - oldScenario (tuple): the (numDay, numPeople, recoverProb, contactRate) of the original scenario
+    - newScenario (tuple): the (numDay, numPeople, recoverProb, contactRate) of the new scenario, with the same number of days
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations of each scenario
+    - confidence (float): confidence level of the bands of the difference, between 0 and 1
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+
+    Returns:
+    - comparison (dict): 'old' and 'new' trajectories of shape (numReplicates, numDay, 3), and 'difference', 'lower' and 'upper' arrays of shape (numDay, 3) with the mean daily difference (new minus old) in the count of susceptible, infectious and recovered people and its confidence band
+    '''
+    oldTrajectories, newTrajectories = runScenarios([oldScenario, newScenario], engine, numReplicates, seed, numWorkers, progress, paired = True)
+    differences = newTrajectories - oldTrajectories
+    difference = differences.mean(axis = 0)
+    # Normal confidence interval of the mean of the paired differences
+    standardError = differences.std(axis = 0, ddof = 1) / np.sqrt(numReplicates) if numReplicates > 1 else np.zeros(difference.shape)
+    margin = NormalDist().inv_cdf((1 + confidence) / 2) * standardError
+    return {
+        'old': oldTrajectories,
+        'new': newTrajectories,
+        'difference': difference,
+        'lower': difference - margin,
+        'upper': difference + margin,
+    }
+
+def metapopulationSteps(numDay, numPeoples, recoverProbs, contactRates, mobility, numReplicates = 1, seed = None, numInfectious = 5):
+    '''
+    Simulates the change in the population of several connected regions day by day, advancing every region of every replicate together
+
+    The residents of region i spend the fraction mobility[i, j] of their day in region j. The people present in a region mix homogeneously with its contact rate, so the residents of region i get infected with probability
+    sum over j of mobility[i, j] * contactRates[j] * (infectious people present in j) / (people present in j), where the people present in j are the sum over k of mobility[k, j] times the residents of k.
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeoples (list): number of residents of every region
+    - recoverProbs (list): probability of recovery in a time step in every region
+    - contactRates (list): rate of contact between a susceptible and an infectious person in each time step in every region
+    - mobility (numpy.ndarray): a (numRegions, numRegions) matrix whose rows sum to 1 with the fraction of the time the residents of each region spend in each region
+    - numReplicates (int): number of simulations to run
+    - seed (int or numpy.random.Generator): seed of the random numbers, or a random number generator to draw from; fresh randomness if None
+    - numInfectious (int or list): number of infectious residents of every region at the start
 
     Returns:
-    - newpopulation (list): a list of people in a population with updated statuses after the simulations
+    - a generator of arrays of shape (numReplicates, numRegions, 3) with the count of susceptible, infectious and recovered residents of every region in every simulation on each day, which stops early once there is nobody infectious left
     '''
-    # Assign to simulation and averageDailyStats empty lists
-    simulations = []
-    averageDailyStats = []
-    # Assign to the daily count of each population composition a list of zero for every day
-    totalDailyNumSusceptible = [0] * numDay
-    totalDailyNumInfectious = [0] * numDay
-    totalDailyNumRecovered = [0] * numDay
-    # Loop through the number of simulations to add the results of every simulation to the simulation list
-    for num in range(5):
-        stats = oneSimulation(numDay, numPeople, recoverProb, contactRate)
-        simulations.append(stats)
-    # Compute the total daily count for each population composition for each day
-    for simulation in simulations:
-        for day in range(numDay):
-            totalDailyNumSusceptible[day] = totalDailyNumSusceptible[day] + simulation[day][0]
-            totalDailyNumInfectious[day] = totalDailyNumInfectious[day] + simulation[day][1]
-            totalDailyNumRecovered[day] = totalDailyNumRecovered[day] + simulation[day][2]
-    # Loop through the number of days of simulation, compute the average daily count of each population composition and the average percentage of infectious people, and add them to the averageDailyStats list
+    numPeoples = np.asarray(numPeoples, dtype = np.int64)
+    numRegions = len(numPeoples)
+    recoverProbs = np.broadcast_to(np.asarray(recoverProbs, dtype = float), (numRegions,))
+    contactRates = np.broadcast_to(np.asarray(contactRates, dtype = float), (numRegions,))
+    mobility = np.asarray(mobility, dtype = float)
+    if mobility.shape != (numRegions, numRegions):
+        raise ValueError("The mobility matrix must have one row and one column per region")
+    if (mobility < 0).any() or not np.allclose(mobility.sum(axis = 1), 1):
+        raise ValueError("Every row of the mobility matrix must be fractions that sum to 1")
+    rng = makeRng(seed)
+    # Keep the size of each group of every region of every replicate in a (numReplicates, numRegions) array
+    infectious = np.broadcast_to(np.minimum(numInfectious, numPeoples), (numReplicates, numRegions)).astype(np.int64)
+    susceptible = numPeoples - infectious
+    recovered = np.zeros((numReplicates, numRegions), dtype = np.int64)
+    # The number of people present in every region does not change, as nobody dies
+    present = np.maximum(numPeoples @ mobility, 1e-300)
     for day in range(numDay):
-        averageDailyStats.append([totalDailyNumSusceptible[day] / 5, totalDailyNumInfectious[day] / 5, totalDailyNumRecovered[day] / 5, (totalDailyNumInfectious[day] / 5) / numPeople])
-    return averageDailyStats
+        numNewRecovered = rng.binomial(infectious, recoverProbs)
+        infectious = infectious - numNewRecovered
+        recovered = recovered + numNewRecovered
 
-def createGraph(old_stats, new_stats = False, filename = "graph.png"):
+        # One matrix product gives the infectious people present in every region, and another the risk of the residents of every region across the regions they visit
+        infectProb = np.minimum(1.0, (contactRates * (infectious @ mobility) / present) @ mobility.T)
+        numNewInfectious = rng.binomial(susceptible, infectProb)
+        susceptible = susceptible - numNewInfectious
+        infectious = infectious + numNewInfectious
+
+        yield np.stack((susceptible, infectious, recovered), axis = 2)
+        if not infectious.any():
+            break
+
+def metapopulationSimulations(numDay, numPeoples, recoverProbs, contactRates, mobility, numReplicates = 5, seed = None, numInfectious = 5):
     '''
-    Creates two graphs to show the changes in the population composition
-    
+    Simulates several connected regions many times and averages the daily population composition of every region and of all regions together
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeoples (list): number of residents of every region
+    - recoverProbs (list): probability of recovery in a time step in every region
+    - contactRates (list): rate of contact between a susceptible and an infectious person in each time step in every region
+    - mobility (numpy.ndarray): a (numRegions, numRegions) matrix whose rows sum to 1 with the fraction of the time the residents of each region spend in each region
+    - numReplicates (int): number of simulations to average over
+    - seed (int or numpy.random.Generator): seed of the random numbers, for reproducible results, or a random number generator to draw from
+    - numInfectious (int or list): number of infectious residents of every region at the start
+
+    Returns:
+    - result (dict): 'regions', an array of shape (numDay, numRegions, 4) with the average daily count of susceptible, infectious and recovered residents and the average fraction of infectious residents of every region, and 'total', a list in the same form as the result of multipleSimulations for all regions together
+    '''
+    days = list(metapopulationSteps(numDay, numPeoples, recoverProbs, contactRates, mobility, numReplicates, seed, numInfectious))
+    numPeoples = np.asarray(numPeoples)
+    # Average over the replicates, and repeat the last day if every simulation ended early
+    mean = np.stack([stats.mean(axis = 0) for stats in days])
+    if len(mean) < numDay:
+        mean = np.concatenate((mean, np.repeat(mean[-1:], numDay - len(mean), axis = 0)))
+    regions = np.concatenate((mean, mean[:, :, 1:2] / numPeoples[:, None]), axis = 2)
+    total = mean.sum(axis = 1)
+    return {
+        'regions': regions,
+        'total': np.column_stack((total, total[:, 1] / numPeoples.sum())).tolist(),
+    }
+
+def summaryMetrics(trajectories, numPeople):
+    '''
+    Computes the summary metrics of a scenario, averaged over its simulations
+
+    Parameters:
+    - trajectories (numpy.ndarray): an array of shape (numReplicates, numDay, 3) with the daily count of susceptible, infectious and recovered people in every simulation
+    - numPeople (int): number of people in a population
+
+    Returns:
+    - metrics (dict): the average peak number of infectious people ('peakInfections'), day of the peak counting from 1 ('peakDay') and fraction of the population ever infected by the last day ('finalAttackRate')
+    '''
+    numInfectious = trajectories[:, :, 1]
+    return {
+        'peakInfections': float(numInfectious.max(axis = 1).mean()),
+        'peakDay': float((numInfectious.argmax(axis = 1) + 1).mean()),
+        'finalAttackRate': float(((numPeople - trajectories[:, -1, 0]) / numPeople).mean()),
+    }
+
+def sweepPoint(numDay, numPeople, recoverProb, contactRate, engine, numReplicates, seed):
+    '''
+    Simulates one point of a parameter sweep; this is the unit of work given to a worker process
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeople (int): number of people in a population
+    - recoverProb (float): probability of recovery in a time step
+    - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations of the point
+    - seed (int or numpy.random.Generator): seed of the random streams, or a random number generator to draw it from
+
+    Returns:
+    - metrics (dict): the summary metrics of the point, as returned by summaryMetrics
+    '''
+    trajectories = runScenarios([(numDay, numPeople, recoverProb, contactRate)], engine, numReplicates, seed)[0]
+    return summaryMetrics(trajectories, numPeople)
+
+# Columns stored for every point of a parameter sweep
+SWEEP_COLUMNS = ['numPeople', 'recoverProb', 'contactRate', 'peakInfections', 'peakDay', 'finalAttackRate']
+
+def parameterSweep(numDay, numPeoples, recoverProbs, contactRates, outputDir, engine = DEFAULT_ENGINE, numReplicates = 5, seed = None, numWorkers = 1):
+    '''
+    Simulates every combination of the given population sizes, recovery probabilities and contact rates and stores the summary metrics of each on disk
+
+    Each point is written to its own .npz file in outputDir as soon as it finishes, so a sweep that is interrupted can be run again and only the missing points are simulated.
+    When every point is done, the columns of all points are also written together to sweep.npz.
+
+    Parameters:
+    - numDay (int): number of days over which the simulation takes place
+    - numPeoples (list): numbers of people in a population to sweep over
+    - recoverProbs (list): probabilities of recovery in a time step to sweep over
+    - contactRates (list): rates of contact between a susceptible and an infectious person in each time step to sweep over
+    - outputDir (string): directory where the results are stored
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - numReplicates (int): number of simulations of each point
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the points
+
+    Returns:
+    - sweep (dict): a dictionary from each name in SWEEP_COLUMNS to an array with one value per point
+    '''
+    os.makedirs(outputDir, exist_ok = True)
+    # Draw the seed of every point from the same entropy, whichever worker runs it
+    seed = seedEntropy(seed)
+    points = list(itertools.product(numPeoples, recoverProbs, contactRates))
+    # What else determines the results of a point: the engine, the number of replicates and the seed
+    run = cacheKey(engine, numReplicates, seed, ENGINE_VERSION)
+    # Skip the points that were already stored with the same parameters by an earlier run
+    pending = []
+    for index, point in enumerate(points):
+        path = os.path.join(outputDir, "point_%06d.npz" % index)
+        if os.path.exists(path):
+            with np.load(path) as stored:
+                if tuple(stored['parameters']) == (numDay, *point) and 'run' in stored.files and str(stored['run']) == run:
+                    continue
+        pending.append((index, point))
+
+    def storePoint(index, point, metrics):
+        # Write to a temporary file first so that an interrupted write never looks like a finished point
+        path = os.path.join(outputDir, "point_%06d.npz" % index)
+        with open(path + ".tmp", 'wb') as file:
+            np.savez(file, parameters = np.array((numDay, *point), dtype = float), run = np.array(run), **metrics)
+        os.replace(path + ".tmp", path)
+
+    # Simulate the remaining points, storing each one as soon as it finishes
+    if numWorkers > 1:
+        executor = getExecutor(numWorkers)
+        futures = {executor.submit(sweepPoint, numDay, *point, engine, numReplicates, seed): (index, point) for index, point in pending}
+        for future in as_completed(futures):
+            storePoint(*futures[future], future.result())
+    else:
+        for index, point in pending:
+            storePoint(index, point, sweepPoint(numDay, *point, engine, numReplicates, seed))
+
+    # Points of an earlier, larger grid may still be in the directory, so only the ones of this grid are loaded
+    sweep = loadSweep(outputDir, range(len(points)))
+    np.savez(os.path.join(outputDir, "sweep.npz"), **sweep)
+    return sweep
+
+def loadSweep(outputDir, indices = None):
+    '''
+    Loads the points of a parameter sweep that are stored on disk
+
+    Parameters:
+    - outputDir (string): directory where the results of the sweep are stored
+    - indices (list): indices in the grid of the points to load; every point stored in the directory if not given
+
+    Returns:
+    - sweep (dict): a dictionary from each name in SWEEP_COLUMNS to an array with one value per finished point, in grid order
+    '''
+    if indices is None:
+        filenames = sorted(filename for filename in os.listdir(outputDir) if filename.startswith("point_") and filename.endswith(".npz"))
+    else:
+        filenames = ["point_%06d.npz" % index for index in indices]
+    columns = {name: [] for name in SWEEP_COLUMNS}
+    for filename in filenames:
+        if os.path.exists(os.path.join(outputDir, filename)):
+            with np.load(os.path.join(outputDir, filename)) as stored:
+                numPeople, recoverProb, contactRate = stored['parameters'][1:]
+                columns['numPeople'].append(int(numPeople))
+                columns['recoverProb'].append(recoverProb)
+                columns['contactRate'].append(contactRate)
+                for name in SWEEP_COLUMNS[3:]:
+                    columns[name].append(float(stored[name]))
+    return {name: np.array(values) for name, values in columns.items()}
+
+def drawGraph(old_stats, new_stats = False, difference = None):
+    '''
+    Draws two graphs to show the changes in the population composition on a figure
+
     Parameters:
     - old_stats (list): a list of average daily count of each population composition and percentage of infectious people based on original statistics
     - new_stats (list): a list of average daily count of each population composition and percentage of infectious people based on new statistics
-    - filename (string): name of downloaded png file of the graphs
+    - difference (dict): the result of pairedComparison; if given, a third graph shows the daily difference in infectious people with its confidence band
 
     Returns:
-    - a downloaded file with two graphs demonstrating the changes in the population composition
+    - fig (matplotlib.figure.Figure): the figure with the two graphs demonstrating the changes in the population composition
     '''
     # Assign to numSusceptible, numInfectious, numRecovered, percentInfectious each an empty list
     numSusceptible = []
@@ -171,8 +1719,16 @@ def createGraph(old_stats, new_stats = False, filename = "graph.png"):
     # Make a list of the number of days of simulations
     numDayList = list(range(1, len(old_stats) + 1))
 
-    # Create two graphs
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize = (14, 6))
+    # matplotlib is imported on first use: it takes most of the time to import this module, and the simulations do not need it
+    from matplotlib.figure import Figure
+
+    # Create two graphs on a figure of its own rather than through pyplot, so that concurrent renders do not share state and the figure is freed once rendered
+    if difference is None:
+        fig = Figure(figsize = (14, 6))
+        ax1, ax2 = fig.subplots(1, 2)
+    else:
+        fig = Figure(figsize = (21, 6))
+        ax1, ax2, ax3 = fig.subplots(1, 3)
 
     # Create the first graph with the average daily count of each population composition
     ax1.plot(numDayList, numSusceptible, label = "Susceptible (Before)")
@@ -203,12 +1759,113 @@ def createGraph(old_stats, new_stats = False, filename = "graph.png"):
     ax2.set_ylabel("Percent Infectious")
     ax2.set_title("Percent Infectious")
     ax2.legend()
-    plt.tight_layout()
 
+    # Create the third graph with the paired difference in infectious people and its confidence band
+    if difference is not None:
+        ax3.fill_between(numDayList, difference['lower'][:, 1], difference['upper'][:, 1], alpha = 0.3, label = "Confidence Band")
+        ax3.plot(numDayList, difference['difference'][:, 1], label = "Infectious (After - Before)")
+        ax3.axhline(0, color = "gray", linewidth = 0.8)
+        ax3.set_xlabel("Time (in Days)")
+        ax3.set_ylabel("Difference in Count")
+        ax3.set_title("Paired Difference")
+        ax3.legend()
+    fig.tight_layout()
+    return fig
+
+def renderGraph(old_stats, new_stats = False, difference = None):
+    '''
+    Renders two graphs to show the changes in the population composition as a PNG image in memory
+
+    Parameters:
+    - old_stats (list): a list of average daily count of each population composition and percentage of infectious people based on original statistics
+    - new_stats (list): a list of average daily count of each population composition and percentage of infectious people based on new statistics
+    - difference (dict): the result of pairedComparison; if given, a third graph shows the daily difference in infectious people with its confidence band
+
+    Returns:
+    - png (bytes): the PNG image of the two graphs demonstrating the changes in the population composition
+    '''
+    with instrumentation.timer('layout'):
+        fig = drawGraph(old_stats, new_stats, difference)
+
+    # Save the graphs to a buffer in memory
+    with instrumentation.timer('encode'):
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format = 'png')
+        return buffer.getvalue()
+
+def warmUp():
+    '''
+    Imports matplotlib and runs the default engine and the graph rendering once on a small population, so that the first request a server takes does not pay for the imports and the setup done on first use, such as loading the fonts
+    '''
+    stats = multipleSimulations(10, 1000, 0.1, 0.3, numReplicates = 2)
+    renderGraph(stats, stats)
+
+def createGraph(old_stats, new_stats = False, filename = "graph.png"):
+    '''
+    Creates two graphs to show the changes in the population composition
+    
+    Parameters:
+    - old_stats (list): a list of average daily count of each population composition and percentage of infectious people based on original statistics
+    - new_stats (list): a list of average daily count of each population composition and percentage of infectious people based on new statistics
+    - filename (string): name of downloaded png file of the graphs
+
+    Returns:
+    - a downloaded file with two graphs demonstrating the changes in the population composition
+    '''
     # Save the graphs for later display
-    plt.savefig("simulations/static/" + filename)
+    with open("simulations/static/" + filename, 'wb') as file:
+        file.write(renderGraph(old_stats, new_stats))
+
+def cachedGraph(key, makeGraph, filename = None):
+    '''
+    Makes a graph, reusing the bytes of the graph from the cache when the same graph was made before
+
+    Parameters:
+    - key (string): cache key of the graph, or None if the graph cannot be reused
+    - makeGraph (function): function without arguments that simulates and renders the graph
+    - filename (string): name of downloaded png file of the graphs; no file is written if None
+
+    Returns:
+    - png (bytes): the PNG image of the graph
+    '''
+    png = resultCache.get(key) if key is not None else None
+    instrumentation.count('graph_cache_hits' if png is not None else 'graph_cache_misses')
+    if png is None:
+        png = makeGraph()
+        if key is not None:
+            resultCache.set(key, png)
+    if filename is not None:
+        with open("simulations/static/" + filename, 'wb') as file:
+            file.write(png)
+    return png
+
+def storeGraph(png):
+    '''
+    Stores a graph in the cache under the hash of its content
+
+    Parameters:
+    - png (bytes): the PNG image of the graph
+
+    Returns:
+    - name (string): the hash of the image, which identifies it in loadGraph
+    '''
+    name = hashlib.sha256(png).hexdigest()
+    resultCache.set(cacheKey('graph', name), png)
+    return name
+
+def loadGraph(name):
+    '''
+    Loads a graph stored by storeGraph
+
+    Parameters:
+    - name (string): the hash of the image
+
+    Returns:
+    - png (bytes): the PNG image of the graph, or None if it is no longer cached
+    '''
+    return resultCache.get(cacheKey('graph', name))
 
-def normalGraph(numDay, numPeople, recoverProb, contactRate):
+def normalGraph(numDay, numPeople, recoverProb, contactRate, seed = None, numWorkers = 1, filename = "normal_graph.png", progress = None, engine = DEFAULT_ENGINE):
     '''
     Creates two graphs demonstrating the changes in the population composition based on original statistics
 
@@ -217,16 +1874,78 @@ def normalGraph(numDay, numPeople, recoverProb, contactRate):
     - numPeople (int): number of people in a population
     - recoverProb (float): probability of recovery in a time step
     - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - filename (string): name of downloaded png file of the graphs; no file is written if None
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+
+    Returns:
+    - png (bytes): the PNG image of two graphs, also downloaded to filename, demonstrating the changes in the population composition based on original statistics
+    '''
+    def makeGraph():
+        # Make a list with average daily count of each population composition and the average percentage of infectious people based on original statistics
+        old_stats = multipleSimulations(numDay, numPeople, recoverProb, contactRate, engine, seed = seed, numWorkers = numWorkers, progress = progress)
+        # Render two graphs demonstrating the changes in the population composition based on original statistics
+        return renderGraph(old_stats)
+
+    # Reuse the graph if it was already made with the same seed
+    key = cacheKey('normalGraph', numDay, numPeople, float(recoverProb), float(contactRate), seed, engine, ENGINE_VERSION) if isReproducible(seed) else None
+    return cachedGraph(key, makeGraph, filename)
+
+def pairedEngine(engine):
+    '''
+    Gets the engine that runs a paired comparison in place of an engine
+
+    Parameters:
+    - engine (string or function): engine asked for
+
+    Returns:
+    - engine (string or function): the 'coupled' engine in place of the binomial engine, whose replicates drift apart when they share a random stream, or the engine itself
+    '''
+    return 'coupled' if engine == 'binomial' else engine
+
+def comparisonGraph(oldScenario, newScenario, seed = None, numWorkers = 1, progress = None, paired = False, engine = DEFAULT_ENGINE, old_stats = None):
+    '''
+    Simulates an original and a new scenario together and renders the graphs comparing them
+
+    Parameters:
+    - oldScenario (tuple): the (numDay, numPeople, recoverProb, contactRate) of the original scenario
+    - newScenario (tuple): the (numDay, numPeople, recoverProb, contactRate) of the new scenario
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+    - paired (bool): if True, drive both scenarios with common random numbers and add a graph of their daily difference with its confidence band
+    - engine (string or function): engine that runs the simulations; in paired mode, the default engine is replaced by the 'coupled' engine, which keeps paired replicates in step
+    - old_stats (list): the average daily statistics of the original scenario as returned by multipleSimulations with the same seed and engine, such as those of the baseline; they are looked up in the cache if not given, and are not used in paired mode, which needs the replicates themselves
 
     Returns:
-    - a downloaded file with two graphs demonstrating the changes in the population composition based on original statistics
+    - png (bytes): the PNG image of the graphs
     '''
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on original statistics
-    old_stats = multipleSimulations(numDay, numPeople, recoverProb, contactRate)
-    # Create a downloaded file with two graphs demonstrating the changes in the population composition based on original statistics
-    createGraph(old_stats, filename = "normal_graph.png")
+    if paired:
+        comparison = pairedComparison(oldScenario, newScenario, pairedEngine(engine), seed = seed, numWorkers = numWorkers, progress = progress)
+        # Make lists with average daily count of each population composition and the average percentage of infectious people based on original and new statistics
+        old_stats = averageStats(comparison['old'], oldScenario[1])
+        new_stats = averageStats(comparison['new'], newScenario[1])
+        return renderGraph(old_stats, new_stats, comparison)
 
-def strategy1Graph(numDay, numPeople, recoverProb, contactRate, new_contactRate):
+    # The original scenario is usually the baseline, whose statistics were stored when its graph was made; every scenario has its own random stream, so simulating the new one alone gives the same results
+    numReplicates = 5
+    if old_stats is None:
+        old_stats = cachedStats(*oldScenario, engine, numReplicates, seed)
+    if old_stats is None:
+        # Simulate the original and new statistics together so that their replicates share the worker processes, and store the original ones for the next comparison
+        old_trajectories, new_trajectories = runScenarios([oldScenario, newScenario], engine, numReplicates, seed, numWorkers, progress)
+        old_stats = averageStats(old_trajectories, oldScenario[1])
+        cacheStats(*oldScenario, engine, numReplicates, seed, old_stats)
+    else:
+        new_trajectories = runScenarios([newScenario], engine, numReplicates, seed, numWorkers, progress)[0]
+    # Make a list with average daily count of each population composition and the average percentage of infectious people based on new statistics
+    new_stats = averageStats(new_trajectories, newScenario[1])
+    # Render the graphs demonstrating the changes in the population composition based on original and new statistics
+    return renderGraph(old_stats, new_stats)
+
+def strategy1Graph(numDay, numPeople, recoverProb, contactRate, new_contactRate, seed = None, numWorkers = 1, filename = "strategy1_graph.png", progress = None, paired = False, engine = DEFAULT_ENGINE, old_stats = None):
     '''
     Creates two graphs demonstrating the changes in the population composition after the contact rate changes
 
@@ -236,18 +1955,26 @@ def strategy1Graph(numDay, numPeople, recoverProb, contactRate, new_contactRate)
     - recoverProb (float): probability of recovery in a time step
     - contactRate (float): original rate of contact between a susceptible and an infectious person in each time step
     - new_contactRate (float): new rate of contact between a susceptible and an infectious person in each time step
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - filename (string): name of downloaded png file of the graphs; no file is written if None
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+    - paired (bool): if True, drive both scenarios with common random numbers and add a graph of their daily difference with its confidence band
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - old_stats (list): the average daily statistics of the original scenario as returned by multipleSimulations with the same seed and engine, to reuse instead of simulating it again, or other statistics of it such as those of adaptiveSimulations; looked up in the cache if not given
 
     Returns:
-    - a downloaded file with two graphs demonstrating the changes in the population composition after the contact rate changes
+    - png (bytes): the PNG image of two graphs, also downloaded to filename, demonstrating the changes in the population composition after the contact rate changes
     '''
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on original statistics
-    old_stats = multipleSimulations(numDay, numPeople, recoverProb, contactRate)
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on new statistics
-    new_stats = multipleSimulations(numDay, numPeople, recoverProb, new_contactRate)
-    # Create a downloaded file with two graphs demonstrating the changes in the population composition based on original and new statistics
-    createGraph(old_stats, new_stats, filename = "strategy1_graph.png")
+    def makeGraph():
+        # Simulate the original and new statistics and render two graphs demonstrating the changes in the population composition
+        return comparisonGraph((numDay, numPeople, recoverProb, contactRate), (numDay, numPeople, recoverProb, new_contactRate), seed, numWorkers, progress, paired, engine, old_stats)
+
+    # Reuse the graph if it was already made with the same seed and original statistics
+    key = cacheKey('strategy1Graph', numDay, numPeople, float(recoverProb), float(contactRate), new_contactRate, seed, pairedEngine(engine) if paired else engine, paired, None if paired or old_stats is None else cacheKey(old_stats), ENGINE_VERSION) if isReproducible(seed) else None
+    return cachedGraph(key, makeGraph, filename)
 
-def strategy2Graph(numDay, numPeople, recoverProb, contactRate, new_recoverProb):
+def strategy2Graph(numDay, numPeople, recoverProb, contactRate, new_recoverProb, seed = None, numWorkers = 1, filename = "strategy2_graph.png", progress = None, paired = False, engine = DEFAULT_ENGINE, old_stats = None):
     '''
     Creates two graphs demonstrating the changes in the population composition after the recovery probability changes
 
@@ -257,18 +1984,26 @@ def strategy2Graph(numDay, numPeople, recoverProb, contactRate, new_recoverProb)
     - recoverProb (float): original probability of recovery in a time step
     - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
     - new_recoverProb (float): new probability of recovery in a time step
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - filename (string): name of downloaded png file of the graphs; no file is written if None
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+    - paired (bool): if True, drive both scenarios with common random numbers and add a graph of their daily difference with its confidence band
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - old_stats (list): the average daily statistics of the original scenario as returned by multipleSimulations with the same seed and engine, to reuse instead of simulating it again, or other statistics of it such as those of adaptiveSimulations; looked up in the cache if not given
 
     Returns:
-    - a downloaded file with two graphs demonstrating the changes in the population composition after the recovery probability changes
+    - png (bytes): the PNG image of two graphs, also downloaded to filename, demonstrating the changes in the population composition after the recovery probability changes
     '''
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on original statistics
-    old_stats = multipleSimulations(numDay, numPeople, recoverProb, contactRate)
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on new statistics
-    new_stats = multipleSimulations(numDay, numPeople, new_recoverProb, contactRate)
-    # Create a downloaded file with two graphs demonstrating the changes in the population composition based on original and new statistics
-    createGraph(old_stats, new_stats, filename = "strategy2_graph.png")
+    def makeGraph():
+        # Simulate the original and new statistics and render two graphs demonstrating the changes in the population composition
+        return comparisonGraph((numDay, numPeople, recoverProb, contactRate), (numDay, numPeople, new_recoverProb, contactRate), seed, numWorkers, progress, paired, engine, old_stats)
+
+    # Reuse the graph if it was already made with the same seed and original statistics
+    key = cacheKey('strategy2Graph', numDay, numPeople, float(recoverProb), float(contactRate), new_recoverProb, seed, pairedEngine(engine) if paired else engine, paired, None if paired or old_stats is None else cacheKey(old_stats), ENGINE_VERSION) if isReproducible(seed) else None
+    return cachedGraph(key, makeGraph, filename)
 
-def strategy3Graph(numDay, numPeople, recoverProb, contactRate, new_numPeople):
+def strategy3Graph(numDay, numPeople, recoverProb, contactRate, new_numPeople, seed = None, numWorkers = 1, filename = "strategy3_graph.png", progress = None, paired = False, engine = DEFAULT_ENGINE, old_stats = None):
     '''
     Creates two graphs demonstrating the changes in the population composition after the number of susceptible people changes
 
@@ -278,13 +2013,21 @@ def strategy3Graph(numDay, numPeople, recoverProb, contactRate, new_numPeople):
     - recoverProb (float): original probability of recovery in a time step
     - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
     - new_numPeople (int): new number of people in a population
+    - seed (int or numpy.random.Generator): seed of the random streams, for reproducible results, or a random number generator to draw it from
+    - numWorkers (int): number of worker processes that share the simulations
+    - filename (string): name of downloaded png file of the graphs; no file is written if None
+    - progress (function): function called with the fraction of the simulations that are done as they progress
+    - paired (bool): if True, drive both scenarios with common random numbers and add a graph of their daily difference with its confidence band
+    - engine (string or function): name of the engine in ENGINES, or an engine function such as a network.NetworkEngine, that runs the simulations
+    - old_stats (list): the average daily statistics of the original scenario as returned by multipleSimulations with the same seed and engine, to reuse instead of simulating it again, or other statistics of it such as those of adaptiveSimulations; looked up in the cache if not given
 
     Returns:
-    - a downloaded file with two graphs demonstrating the changes in the population composition after the number of susceptible people changes
+    - png (bytes): the PNG image of two graphs, also downloaded to filename, demonstrating the changes in the population composition after the number of susceptible people changes
     '''
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on original statistics
-    old_stats = multipleSimulations(numDay, numPeople, recoverProb, contactRate)
-    # Make a list with average daily count of each population composition and the average percentage of infectious people based on new statistics
-    new_stats = multipleSimulations(numDay, new_numPeople, recoverProb, contactRate)
-    # Create a downloaded file with two graphs demonstrating the changes in the population composition based on original and new statistics
-    createGraph(old_stats, new_stats, filename = "strategy3_graph.png")
\ No newline at end of file
+    def makeGraph():
+        # Simulate the original and new statistics and render two graphs demonstrating the changes in the population composition
+        return comparisonGraph((numDay, numPeople, recoverProb, contactRate), (numDay, new_numPeople, recoverProb, contactRate), seed, numWorkers, progress, paired, engine, old_stats)
+
+    # Reuse the graph if it was already made with the same seed and original statistics
+    key = cacheKey('strategy3Graph', numDay, numPeople, float(recoverProb), float(contactRate), new_numPeople, seed, pairedEngine(engine) if paired else engine, paired, None if paired or old_stats is None else cacheKey(old_stats), ENGINE_VERSION) if isReproducible(seed) else None
+    return cachedGraph(key, makeGraph, filename)
@@ -0,0 +1,225 @@
+# Import the necessary modules
+import os
+import numpy as np
+from agents import SUSCEPTIBLE, INFECTIOUS, RECOVERED
+
+# Status code of the people of a contact graph who are left out of a smaller population
+ABSENT = 3
+
+# Number of rows of the adjacency matrix whose contacts are gathered at once, which bounds the memory taken by a product
+ROWS_PER_CHUNK = 1 << 18
+
+# The contacts of the marked people are added up directly when they are fewer than this fraction of all contacts, instead of gathering the marks of every row
+PUSH_FACTOR = 4
+
+class ContactGraph:
+    '''
+    Undirected contact graph stored as a sparse adjacency matrix in compressed sparse row (CSR) form: the contacts of person i are indices[indptr[i]:indptr[i + 1]]
+
+    Parameters:
+    - indptr (numpy.ndarray): offsets of the contacts of every person in indices, of length numNodes + 1
+    - indices (numpy.ndarray): the contacts of every person, one after another
+    '''
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.numNodes = len(indptr) - 1
+        self.numEdges = len(indices) // 2
+
+    @classmethod
+    def fromEdges(cls, sources, targets, numNodes = None):
+        '''
+        Builds a contact graph from its edges; every edge is a contact in both directions, and edges from a person to themselves are dropped
+
+        Parameters:
+        - sources (numpy.ndarray): the first person of every edge, numbered from 0
+        - targets (numpy.ndarray): the second person of every edge
+        - numNodes (int): number of people; one more than the largest number in the edges if not given
+
+        Returns:
+        - graph (ContactGraph): the contact graph
+        '''
+        sources = np.asarray(sources, dtype = np.int64)
+        targets = np.asarray(targets, dtype = np.int64)
+        keep = sources != targets
+        sources, targets = sources[keep], targets[keep]
+        if numNodes is None:
+            numNodes = int(max(sources.max(initial = -1), targets.max(initial = -1))) + 1
+        if len(sources) and (min(sources.min(), targets.min()) < 0 or max(sources.max(), targets.max()) >= numNodes):
+            raise ValueError("Edges must join people numbered from 0 to " + str(numNodes - 1))
+        rows = np.concatenate((sources, targets))
+        columns = np.concatenate((targets, sources))
+        # The order of the contacts of a person does not matter, so the rows can be sorted with an unstable sort, which is faster
+        order = np.argsort(rows)
+        indptr = np.zeros(numNodes + 1, dtype = np.int64)
+        np.cumsum(np.bincount(rows, minlength = numNodes), out = indptr[1:])
+        # People are numbered with 32 bits to halve the size of the largest array
+        return cls(indptr, columns[order].astype(np.int32))
+
+    @classmethod
+    def fromEdgeList(cls, path, numNodes = None):
+        '''
+        Reads a contact graph from a text file with one edge per line, given as two numbers separated by whitespace
+
+        Parameters:
+        - path (string): path of the edge list
+        - numNodes (int): number of people; one more than the largest number in the file if not given
+
+        Returns:
+        - graph (ContactGraph): the contact graph
+        '''
+        edges = np.fromfile(path, dtype = np.int64, sep = ' ')
+        if len(edges) % 2:
+            raise ValueError("An edge list must have two numbers on every line: " + str(path))
+        return cls.fromEdges(edges[0::2], edges[1::2], numNodes)
+
+    def save(self, directory):
+        '''
+        Stores the adjacency matrix in a directory, from which load can map it into memory
+
+        Parameters:
+        - directory (string): directory to store the arrays in
+        '''
+        os.makedirs(directory, exist_ok = True)
+        np.save(os.path.join(directory, "indptr.npy"), self.indptr)
+        np.save(os.path.join(directory, "indices.npy"), self.indices)
+
+    @classmethod
+    def load(cls, directory, mmap = True):
+        '''
+        Loads an adjacency matrix stored by save
+
+        Parameters:
+        - directory (string): directory where the arrays are stored
+        - mmap (bool): if True, map the arrays into memory instead of reading them, so that graphs larger than the memory can be used and the pages are shared between processes
+
+        Returns:
+        - graph (ContactGraph): the contact graph
+        '''
+        mode = 'r' if mmap else None
+        return cls(np.load(os.path.join(directory, "indptr.npy"), mmap_mode = mode), np.load(os.path.join(directory, "indices.npy"), mmap_mode = mode))
+
+    def degrees(self):
+        '''
+        Gets the number of contacts of every person
+
+        Returns:
+        - degrees (numpy.ndarray): the number of contacts of every person
+        '''
+        return np.diff(self.indptr)
+
+    def neighbourCounts(self, marked):
+        '''
+        Counts the marked contacts of every person, which is the product of the adjacency matrix with the vector of marks
+
+        Parameters:
+        - marked (numpy.ndarray): an array of 0 and 1 of type uint8 with one entry per person
+
+        Returns:
+        - counts (numpy.ndarray): the number of marked contacts of every person
+        '''
+        marks = np.flatnonzero(marked)
+        # With few marked people, adding their contacts up is cheaper than visiting every row; the matrix is symmetric, so both give the same product
+        starts = np.asarray(self.indptr[marks])
+        lengths = np.asarray(self.indptr[marks + 1]) - starts
+        if lengths.sum() * PUSH_FACTOR < len(self.indices):
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            return np.bincount(self.indices[positions], minlength = self.numNodes).astype(np.int32)
+        counts = np.empty(self.numNodes, dtype = np.int32)
+        # Otherwise, gather the marks of the contacts of a block of rows at a time, and sum each row as the difference of a running total at its two ends
+        for start in range(0, self.numNodes, ROWS_PER_CHUNK):
+            end = min(start + ROWS_PER_CHUNK, self.numNodes)
+            offsets = np.asarray(self.indptr[start:end + 1])
+            totals = np.zeros(offsets[-1] - offsets[0] + 1, dtype = np.int32)
+            np.cumsum(marked[self.indices[offsets[0]:offsets[-1]]], dtype = np.int32, out = totals[1:])
+            counts[start:end] = totals[offsets[1:] - offsets[0]] - totals[offsets[:-1] - offsets[0]]
+        return counts
+
+# Contact graphs loaded by the network engines of this process, by directory
+graphs = {}
+
+class NetworkEngine:
+    '''
+    Engine that simulates the epidemic on a contact graph stored by ContactGraph.save; it can be given as the engine of the simulation functions of main and sent to worker processes, which map the graph into memory themselves
+
+    Each day, every infectious person transmits the infection to each susceptible contact with probability contactRate / mean number of contacts, so that on a complete graph the model is the same as the model of main with homogeneous mixing.
+    When the population is smaller than the graph, only the first numPeople people of the graph take part.
+
+    Parameters:
+    - directory (string): directory where the contact graph is stored
+    - mmap (bool): if True, map the graph into memory instead of reading it
+    '''
+    def __init__(self, directory, mmap = True):
+        self.directory = os.path.abspath(directory)
+        self.mmap = mmap
+
+    def __repr__(self):
+        # The representation is part of the cache keys of the results, so it changes when the stored graph does
+        modified = os.path.getmtime(os.path.join(self.directory, "indices.npy"))
+        return "NetworkEngine(%r, modified = %r)" % (self.directory, modified)
+
+    def __eq__(self, other):
+        return isinstance(other, NetworkEngine) and other.directory == self.directory
+
+    def __hash__(self):
+        return hash(self.directory)
+
+    def graph(self):
+        '''
+        Gets the contact graph, loading it the first time it is needed in this process
+
+        Returns:
+        - graph (ContactGraph): the contact graph
+        '''
+        if self.directory not in graphs:
+            graphs[self.directory] = ContactGraph.load(self.directory, self.mmap)
+        return graphs[self.directory]
+
+    def __call__(self, numDay, numPeople, recoverProb, contactRate, rng = None):
+        '''
+        Simulates the change in the population day by day on the contact graph
+
+        Parameters:
+        - numDay (int): number of days over which the simulation takes place
+        - numPeople (int): number of people in a population, at most the number of people in the graph
+        - recoverProb (float): probability of recovery in a time step
+        - contactRate (float): rate of contact between a susceptible and an infectious person in each time step
+        - rng (numpy.random.Generator): random number generator to draw from; a new unseeded one if not given
+
+        Returns:
+        - a generator of the daily count of susceptible, infectious and recovered people, which stops early if the number of susceptible or infectious people reaches 0
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        graph = self.graph()
+        if numPeople > graph.numNodes:
+            raise ValueError("The contact graph only has " + str(graph.numNodes) + " people")
+        transmitProb = min(1.0, contactRate * graph.numNodes / max(2 * graph.numEdges, 1))
+        numInfectious = min(5, numPeople)
+        population = np.full(graph.numNodes, ABSENT, dtype = np.int8)
+        population[:numPeople] = SUSCEPTIBLE
+        population[:numInfectious] = INFECTIOUS
+        numSusceptible = numPeople - numInfectious
+        numRecovered = 0
+        draws = np.empty(graph.numNodes)
+        for day in range(numDay):
+            rng.random(out = draws)
+            recovered = (population == INFECTIOUS) & (draws < recoverProb)
+            population[recovered] = RECOVERED
+            numNewRecovered = int(np.count_nonzero(recovered))
+            numInfectious = numInfectious - numNewRecovered
+            numRecovered = numRecovered + numNewRecovered
+
+            # A susceptible person with k infectious contacts escapes all of them with probability (1 - transmitProb) ** k
+            pressure = graph.neighbourCounts((population == INFECTIOUS).view(np.uint8))
+            rng.random(out = draws)
+            infected = (population == SUSCEPTIBLE) & (pressure > 0)
+            infected[infected] = draws[infected] < 1 - (1 - transmitProb) ** pressure[infected]
+            population[infected] = INFECTIOUS
+            numNewInfectious = int(np.count_nonzero(infected))
+            numSusceptible = numSusceptible - numNewInfectious
+            numInfectious = numInfectious + numNewInfectious
+
+            yield [numSusceptible, numInfectious, numRecovered]
+            if numSusceptible == 0 or numInfectious == 0:
+                break
@@ -0,0 +1,152 @@
+# Import the necessary modules
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+def cacheKey(*parts):
+    '''
+    Makes a cache key from the values that determine a result
+
+    Parameters:
+    - parts: values that determine the result, such as its kind and the parameters of the simulation
+
+    Returns:
+    - key (string): a hexadecimal digest of the values
+    '''
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+class ResultCache:
+    '''
+    Two-tier cache of byte strings: a small least-recently-used tier in memory in front of a larger tier on disk
+
+    Parameters:
+    - directory (string): directory of the disk tier
+    - maxMemoryItems (int): number of values kept in memory
+    - maxDiskBytes (int): total size of the files kept on disk; the least recently used files are removed beyond it
+
+    The total size of the disk tier is counted when the first value is stored and then kept up to date with the values this cache stores, so the files are only scanned again when it goes over maxDiskBytes.
+    Values stored by other processes sharing the directory are counted at that scan.
+    '''
+    def __init__(self, directory, maxMemoryItems = 128, maxDiskBytes = 256 * 1024 * 1024):
+        self.directory = directory
+        self.maxMemoryItems = maxMemoryItems
+        self.maxDiskBytes = maxDiskBytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # Total size of the files of the disk tier, or None until they are first scanned
+        self.diskBytes = None
+
+    def path(self, key):
+        '''
+        Gets the path of the file that stores a key on disk
+
+        Parameters:
+        - key (string): cache key
+
+        Returns:
+        - path (string): path of the file
+        '''
+        return os.path.join(self.directory, key[:2], key + ".bin")
+
+    def get(self, key):
+        '''
+        Looks up a value, first in memory and then on disk
+
+        Parameters:
+        - key (string): cache key
+
+        Returns:
+        - value (bytes): the cached value, or None if the key is not cached
+        '''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = file.read()
+            # Mark the file as recently used so that it is evicted last
+            os.utime(path)
+        except OSError:
+            return None
+        self.remember(key, value)
+        return value
+
+    def set(self, key, value):
+        '''
+        Stores a value in memory and on disk
+
+        Parameters:
+        - key (string): cache key
+        - value (bytes): value to store
+        '''
+        self.remember(key, value)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        try:
+            replacedBytes = os.stat(path).st_size
+        except OSError:
+            replacedBytes = 0
+        # Write to a temporary file first so that readers never see a partly written value
+        temporaryPath = path + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+        with open(temporaryPath, 'wb') as file:
+            file.write(value)
+        os.replace(temporaryPath, path)
+        with self.lock:
+            if self.diskBytes is not None:
+                self.diskBytes = self.diskBytes + len(value) - replacedBytes
+            overBudget = self.diskBytes is None or self.diskBytes > self.maxDiskBytes
+        if overBudget:
+            self.evict()
+
+    def remember(self, key, value):
+        '''
+        Stores a value in the memory tier, dropping the least recently used values beyond maxMemoryItems
+
+        Parameters:
+        - key (string): cache key
+        - value (bytes): value to store
+        '''
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.maxMemoryItems:
+                self.memory.popitem(last = False)
+
+    def evict(self):
+        '''
+        Removes the least recently used files of the disk tier until their total size is at most maxDiskBytes
+        '''
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                for item in os.scandir(entry.path):
+                    if item.name.endswith(".bin"):
+                        status = item.stat()
+                        files.append((status.st_mtime, status.st_size, item.path))
+        totalBytes = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if totalBytes <= self.maxDiskBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            totalBytes = totalBytes - size
+        with self.lock:
+            self.diskBytes = totalBytes
+
+    def clear(self):
+        '''
+        Removes every value from memory and from disk
+        '''
+        with self.lock:
+            self.memory.clear()
+            self.diskBytes = None
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_dir():
+                    for item in os.scandir(entry.path):
+                        os.remove(item.path)
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class SimulationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'simulations'
+
+
+def warm_up():
+    # Import the simulation engines and matplotlib and run them once, when SIMULATION_WARM_UP is set, so that the first request does not wait for them.
+    # The WSGI and ASGI applications call it as they load: a server that forks its workers after loading the application (such as gunicorn --preload) warms up once and shares the pages with every worker, and one that loads it in each worker warms up every worker before it takes requests.
+    if getattr(settings, 'SIMULATION_WARM_UP', False):
+        import main
+        main.warmUp()
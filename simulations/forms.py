@@ -11,9 +11,27 @@ class SimulationForm(forms.Form):
     )
     recover_prob = forms.FloatField(
         label='Recovery Probability',
+        min_value=0,
+        max_value=1,
         widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
     )
     contact_rate = forms.FloatField(
         label='Contact Rate',
+        min_value=0,
         widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
-    )
\ No newline at end of file
+    )
+    # Adaptive mode: replicates are added until the confidence intervals of the peak and of the final fraction of recovered people are within the precision, or the time budget runs out
+    tolerance = forms.FloatField(
+        label='Target Precision (optional, ± fraction of the population)',
+        required=False,
+        min_value=0.0001,
+        max_value=1,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001'})
+    )
+    time_budget = forms.FloatField(
+        label='Time Budget (seconds, with a target precision)',
+        required=False,
+        min_value=0.1,
+        max_value=600,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '1'})
+    )
@@ -0,0 +1,56 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+class JobQueue:
+    # Runs simulations in a pool of worker threads so that requests can return before the simulations finish
+
+    def __init__(self, max_workers, max_finished_jobs=1000):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='simulation-job')
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()
+        # Jobs that are queued or running, by the key of what they compute, so that identical jobs are only run once
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        # Queue function(*args, progress=callback) and return the id of its job, or the id of an identical job that has not finished yet
+        with self.lock:
+            if key in self.in_flight:
+                return self.in_flight[key]
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {'id': job_id, 'status': 'queued', 'progress': 0.0, 'result': None, 'error': None}
+            self.in_flight[key] = job_id
+        self.executor.submit(self.run, job_id, key, function, args)
+        return job_id
+
+    def run(self, job_id, key, function, args):
+        job = self.jobs[job_id]
+        job['status'] = 'running'
+
+        def progress(fraction):
+            job['progress'] = fraction
+
+        try:
+            job['result'] = function(*args, progress=progress)
+            job['progress'] = 1.0
+            job['status'] = 'done'
+        except Exception as exc:
+            job['error'] = str(exc)
+            job['status'] = 'failed'
+        with self.lock:
+            del self.in_flight[key]
+            # Forget the oldest finished jobs so that the queue does not grow without bound
+            finished = [other_id for other_id, other in self.jobs.items() if other['status'] in ('done', 'failed')]
+            for other_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                del self.jobs[other_id]
+
+    def status(self, job_id):
+        # Return a copy of the state of a job, or None if there is no such job
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+job_queue = JobQueue(getattr(settings, 'SIMULATION_JOB_WORKERS', 2))
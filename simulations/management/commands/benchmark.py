@@ -0,0 +1,211 @@
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+import main
+from resultcache import ResultCache
+
+# Largest population each engine is benchmarked at: the per-person engines need memory and time in proportion to the population, and the exact event-by-event engine time in proportion to the number of events
+ENGINE_MAX_PEOPLE = {
+    'list': 10 ** 4,
+    'numpy': 10 ** 7,
+    'agents': 10 ** 7,
+    'gillespie': 10 ** 5,
+    'tauleap': 10 ** 7,
+}
+
+FUNCTIONS = ['oneSimulation', 'multipleSimulations', 'createGraph', 'result', 'startup']
+
+# Code run in a fresh interpreter by the startup cases: the interpreter alone, importing the simulation module, loading the WSGI application, and loading it and serving the index page
+STARTUP = {
+    'interpreter': 'pass',
+    'import main': 'import main',
+    'application': 'from sir_simulator.wsgi import application',
+    'first index': (
+        'from sir_simulator.wsgi import application\n'
+        'from wsgiref.util import setup_testing_defaults\n'
+        'environ = {}\n'
+        'setup_testing_defaults(environ)\n'
+        'application(environ, lambda status, headers: None)'
+    ),
+}
+
+# Changes smaller than these are measurement noise, however large they are relative to the baseline
+LATENCY_NOISE_MS = 0.05
+MEMORY_NOISE_BYTES = 1024 * 1024
+
+def max_rss():
+    # Peak resident set size of this process in bytes; Linux reports it in kilobytes and macOS in bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = settings.BASE_DIR, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(function, repeats):
+    # Run the function once while tracing allocations to find its peak memory, then time it without tracing, which would slow it down
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return latencies, peak
+
+def case_key(case):
+    return '%s[%s] people=%d days=%d replicates=%d' % (case['function'], case['engine'], case['numPeople'], case['numDay'], case['numReplicates'])
+
+class Command(BaseCommand):
+    help = 'Benchmark the simulation engines, graph rendering, the result page and starting up, record the results in a JSON history file and compare them with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs = '+', type = float, default = [1e3, 1e4, 1e5, 1e6, 1e7, 1e8], help = 'population sizes; each engine only runs up to its size in ENGINE_MAX_PEOPLE')
+        parser.add_argument('--days', nargs = '+', type = int, default = [100], help = 'numbers of days to simulate')
+        parser.add_argument('--replicates', nargs = '+', type = int, default = [5], help = 'numbers of replicates for multipleSimulations')
+        parser.add_argument('--engines', nargs = '+', default = list(main.ENGINES) + list(main.DETERMINISTIC_ENGINES), help = 'engines to benchmark')
+        parser.add_argument('--functions', nargs = '+', choices = FUNCTIONS, default = FUNCTIONS, help = 'code paths to benchmark')
+        parser.add_argument('--repeats', type = int, default = 5, help = 'timed runs of every case')
+        parser.add_argument('--history', default = os.path.join(settings.BASE_DIR, 'benchmark_history.json'), help = 'JSON file the run is appended to')
+        parser.add_argument('--save-baseline', help = 'also write the run to this file, to compare later runs with')
+        parser.add_argument('--compare', help = 'baseline file written by --save-baseline to compare the run with')
+        parser.add_argument('--threshold', type = float, default = 0.25, help = 'relative slowdown or memory growth over the baseline that counts as a regression')
+
+    def cases(self, options):
+        # Every combination of the options that applies to each code path
+        sizes = [int(size) for size in options['sizes']]
+        engines = options['engines']
+        for function in options['functions']:
+            # Starting up does not depend on the simulation at all
+            if function == 'startup':
+                for target in STARTUP:
+                    yield {'function': function, 'engine': target, 'numPeople': 0, 'numDay': 0, 'numReplicates': 0}
+                continue
+            # Rendering a graph does not depend on the size of the population
+            for numPeople in (sizes[:1] if function == 'createGraph' else sizes):
+                for numDay in options['days']:
+                    if function in ('oneSimulation', 'multipleSimulations'):
+                        for engine in engines:
+                            if numPeople > ENGINE_MAX_PEOPLE.get(engine, numPeople):
+                                continue
+                            if function == 'oneSimulation' and engine not in main.ENGINES:
+                                continue
+                            for numReplicates in (options['replicates'] if function == 'multipleSimulations' else [1]):
+                                yield {'function': function, 'engine': engine, 'numPeople': numPeople, 'numDay': numDay, 'numReplicates': numReplicates}
+                    else:
+                        yield {'function': function, 'engine': main.DEFAULT_ENGINE, 'numPeople': numPeople, 'numDay': numDay, 'numReplicates': 5}
+
+    def runner(self, case, client):
+        # A function without arguments that runs the case once
+        numDay, numPeople, engine = case['numDay'], case['numPeople'], case['engine']
+        if case['function'] == 'oneSimulation':
+            return lambda: main.oneSimulation(numDay, numPeople, 0.1, 0.3, engine)
+        if case['function'] == 'multipleSimulations':
+            return lambda: main.multipleSimulations(numDay, numPeople, 0.1, 0.3, engine, case['numReplicates'])
+        if case['function'] == 'createGraph':
+            # createGraph renders the graph and writes it to the static files; render it only, so that the benchmark does not change them
+            stats = main.deterministicStats(numDay, numPeople, 0.1, 0.3)
+            return lambda: main.renderGraph(stats, stats)
+        if case['function'] == 'startup':
+            # Time a fresh interpreter, so that the modules imported by this one do not hide the cost of importing them
+            return lambda: subprocess.run([sys.executable, '-c', STARTUP[engine]], cwd = settings.BASE_DIR, env = dict(os.environ, DJANGO_SETTINGS_MODULE = os.environ.get('DJANGO_SETTINGS_MODULE', 'sir_simulator.settings')), capture_output = True, check = True)
+        def post():
+            response = client.post('/result/', {
+                'baseline_submitted': '1', 'num_days': numDay, 'population': numPeople,
+                'recover_prob': 0.1, 'contact_rate': 0.3,
+            })
+            # Timing an error page would hide a broken result page behind fast latencies
+            if response.status_code != 200:
+                raise CommandError('The result page answered with status %d.' % response.status_code)
+        return post
+
+    def handle(self, *args, **options):
+        results = []
+        # Keep the graphs of the result page out of the result cache, and the sessions out of the database, and accept the host of the client whatever the settings
+        original_cache = main.resultCache
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies', ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'localhost']):
+            main.resultCache = ResultCache(cache_dir)
+            client = Client(SERVER_NAME = 'localhost')
+            try:
+                for case in self.cases(options):
+                    latencies, peak = measure(self.runner(case, client), options['repeats'])
+                    latencies = numpy.array(latencies)
+                    result = dict(case, key = case_key(case), repeats = options['repeats'], peakTracedBytes = peak)
+                    result['latencyMs'] = {
+                        'mean': float(latencies.mean() * 1e3),
+                        'p50': float(numpy.percentile(latencies, 50) * 1e3),
+                        'p90': float(numpy.percentile(latencies, 90) * 1e3),
+                        'p99': float(numpy.percentile(latencies, 99) * 1e3),
+                    }
+                    result['personDaysPerSecond'] = case['numPeople'] * case['numDay'] * case['numReplicates'] / max(float(numpy.median(latencies)), 1e-12)
+                    results.append(result)
+                    self.stdout.write('%-70s p50 %10.2f ms  %12.3g person-days/s  peak %8.1f MB' % (
+                        result['key'], result['latencyMs']['p50'], result['personDaysPerSecond'], peak / 1e6))
+            finally:
+                main.resultCache = original_cache
+
+        run = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'maxRssBytes': max_rss(),
+            'results': results,
+        }
+        self.stdout.write('Peak resident set size: %.1f MB' % (run['maxRssBytes'] / 1e6))
+
+        # Append the run to the history
+        history = []
+        if os.path.exists(options['history']):
+            with open(options['history']) as file:
+                history = json.load(file)
+        history.append(run)
+        with open(options['history'] + '.tmp', 'w') as file:
+            json.dump(history, file, indent = 1)
+        os.replace(options['history'] + '.tmp', options['history'])
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(run, file, indent = 1)
+
+        if options['compare']:
+            self.compare(run, options['compare'], options['threshold'])
+
+    def compare(self, run, baseline_path, threshold):
+        # Flag every case that got slower or took more memory than the baseline by more than the threshold
+        with open(baseline_path) as file:
+            baseline = {result['key']: result for result in json.load(file)['results']}
+        regressions = []
+        for result in run['results']:
+            before = baseline.get(result['key'])
+            if before is None:
+                continue
+            latency_ratio = result['latencyMs']['p50'] / max(before['latencyMs']['p50'], 1e-9)
+            memory_ratio = result['peakTracedBytes'] / max(before['peakTracedBytes'], 1)
+            flags = []
+            if latency_ratio > 1 + threshold and result['latencyMs']['p50'] - before['latencyMs']['p50'] > LATENCY_NOISE_MS:
+                flags.append('latency x%.2f' % latency_ratio)
+            if memory_ratio > 1 + threshold and result['peakTracedBytes'] - before['peakTracedBytes'] > MEMORY_NOISE_BYTES:
+                flags.append('memory x%.2f' % memory_ratio)
+            status = 'REGRESSION ' + ', '.join(flags) if flags else 'ok'
+            self.stdout.write('%-70s latency x%.2f  memory x%.2f  %s' % (result['key'], latency_ratio, memory_ratio, status))
+            if flags:
+                regressions.append(result['key'])
+        if regressions:
+            raise CommandError('%d case(s) regressed against %s' % (len(regressions), baseline_path))
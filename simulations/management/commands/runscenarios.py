@@ -0,0 +1,158 @@
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy
+from django.core.management.base import BaseCommand
+from django.utils.text import get_valid_filename
+from simulations.forms import SimulationForm
+from simulations.views import STRATEGY_PARAMETERS, parse_strategy
+import main
+
+def scenario_trajectories(scenario, engine, num_replicates, seed):
+    # Simulate a scenario without going through the result cache, which a batch of thousands of scenarios would only fill up
+    if engine in main.DETERMINISTIC_ENGINES:
+        # The mean-field limit is a single trajectory
+        return numpy.array(main.deterministicStats(*scenario, engine))[numpy.newaxis, :, :3]
+    return main.runScenarios([scenario], engine, num_replicates, seed)[0]
+
+def run_scenario(scenarios, engine, num_replicates, seed, chart, daily):
+    # Simulate the baseline of a line and its strategy, if any, and return the record to write for it; an error is returned rather than raised, so that it only fails this line
+    start = time.perf_counter()
+    try:
+        record = {'status': 'ok'}
+        all_stats = []
+        for name, scenario in zip(('baseline', 'strategy'), scenarios):
+            trajectories = scenario_trajectories(scenario, engine, num_replicates, seed)
+            stats = main.averageStats(trajectories, scenario[1])
+            all_stats.append(stats)
+            record[name] = main.summaryMetrics(trajectories, scenario[1])
+            if daily:
+                record[name]['stats'] = stats
+        if chart is not None:
+            with open(chart, 'wb') as file:
+                file.write(main.renderGraph(*all_stats))
+            record['chart'] = chart
+    except Exception as error:
+        record = {'status': 'error', 'error': '%s: %s' % (type(error).__name__, error), 'traceback': traceback.format_exc()}
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+def parse_scenario(data, options):
+    # Read a scenario of the input; return the arguments of run_scenario except the chart, or raise ValueError with what is wrong with it
+    form = SimulationForm(data)
+    if not form.is_valid():
+        raise ValueError(' '.join('%s: %s' % (field, ' '.join(errors)) for field, errors in form.errors.items()))
+    baseline = (form.cleaned_data['num_days'], form.cleaned_data['population'], form.cleaned_data['recover_prob'], form.cleaned_data['contact_rate'])
+    scenarios = [baseline]
+    # A strategy has the same fields as on the result page, such as {"strategy": "strategy1", "new_contactRate": 0.2}
+    if data.get('strategy') is not None:
+        graph_function, new_value, error = parse_strategy(data)
+        if graph_function is None:
+            raise ValueError(error or 'Unknown strategy: %s' % data['strategy'])
+        scenario = list(baseline)
+        scenario[STRATEGY_PARAMETERS[data['strategy']]] = new_value
+        scenarios.append(tuple(scenario))
+    engine = data.get('engine', options['engine'])
+    if not isinstance(engine, str) or engine not in main.ENGINES and engine not in main.DETERMINISTIC_ENGINES:
+        raise ValueError('Unknown engine: %s' % engine)
+    num_replicates = data.get('replicates', options['replicates'])
+    # JSON true is a bool, which is an int to isinstance
+    if type(num_replicates) is not int or num_replicates < 1:
+        raise ValueError('The number of replicates must be a positive integer.')
+    seed = data.get('seed', options['seed'])
+    if seed is not None and type(seed) is not int:
+        raise ValueError('The seed must be an integer.')
+    return scenarios, engine, num_replicates, seed
+
+class Command(BaseCommand):
+    help = 'Simulate the scenarios of a JSONL file in a pool of worker processes and write the summary metrics of each as a line of JSONL as soon as it finishes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help = "JSONL file of scenarios, or '-' for the standard input; each line has num_days, population, recover_prob and contact_rate, and optionally an id, seed, engine, number of replicates, and a strategy with its new value as on the result page")
+        parser.add_argument('--output', default = '-', help = "JSONL file to write the results to, or '-' for the standard output")
+        parser.add_argument('--charts', help = 'directory to write the graph of every scenario to, as <id>.png')
+        parser.add_argument('--daily', action = 'store_true', help = 'also write the average daily statistics of every scenario')
+        parser.add_argument('--workers', type = int, default = os.cpu_count() or 1, help = 'worker processes; the scenarios run in this process if 1')
+        parser.add_argument('--max-pending', type = int, help = 'scenarios read ahead of the results written, which bounds the memory taken; twice the number of workers by default')
+        parser.add_argument('--engine', default = main.DEFAULT_ENGINE, help = 'engine of the scenarios that do not give one')
+        parser.add_argument('--replicates', type = int, default = 5, help = 'replicates of the scenarios that do not give a number')
+        parser.add_argument('--seed', type = int, help = 'seed of the scenarios that do not give one; every scenario still gets its own random stream')
+
+    def handle(self, *args, **options):
+        if options['charts']:
+            os.makedirs(options['charts'], exist_ok = True)
+        max_pending = options['max_pending'] or 2 * options['workers']
+        source = sys.stdin if options['input'] == '-' else open(options['input'])
+        self.output = self.stdout if options['output'] == '-' else open(options['output'], 'w')
+        self.num_done = self.num_failed = 0
+        self.verbosity = options['verbosity']
+        start = time.perf_counter()
+        executor = ProcessPoolExecutor(options['workers']) if options['workers'] > 1 else None
+        pending = {}
+        try:
+            # Read the scenarios one line at a time, so that only the ones in flight are in memory
+            for line, text in enumerate(source, 1):
+                if not text.strip():
+                    continue
+                scenario_id = 'line-%d' % line
+                try:
+                    data = json.loads(text)
+                    if not isinstance(data, dict):
+                        raise ValueError('A scenario must be a JSON object.')
+                    if data.get('id') is not None:
+                        scenario_id = str(data['id'])
+                    arguments = parse_scenario(data, options)
+                except (TypeError, ValueError) as error:
+                    # A value of the wrong JSON type fails this line only
+                    self.write(line, scenario_id, {'status': 'error', 'error': str(error)})
+                    continue
+                chart = os.path.join(options['charts'], get_valid_filename(scenario_id) + '.png') if options['charts'] else None
+                if executor is None:
+                    self.write(line, scenario_id, run_scenario(*arguments, chart, options['daily']))
+                    continue
+                # Wait for a result before reading further once enough scenarios are in flight
+                while len(pending) >= max_pending:
+                    done, not_done = wait(pending, return_when = FIRST_COMPLETED)
+                    executor = self.finish(done, pending, executor, options['workers'])
+                pending[executor.submit(run_scenario, *arguments, chart, options['daily'])] = (line, scenario_id, executor)
+            while pending:
+                done, not_done = wait(pending, return_when = FIRST_COMPLETED)
+                executor = self.finish(done, pending, executor, options['workers'])
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures = True)
+            if source is not sys.stdin:
+                source.close()
+            if self.output is not self.stdout:
+                self.output.close()
+        self.stderr.write('%d scenarios, %d failed, in %.1f s' % (self.num_done, self.num_failed, time.perf_counter() - start))
+
+    def finish(self, done, pending, executor, num_workers):
+        # Write the results of the finished scenarios; a worker that dies breaks the pool, so the scenarios in it fail and a new pool takes the next ones
+        for future in done:
+            line, scenario_id, future_executor = pending.pop(future)
+            try:
+                record = future.result()
+            except BrokenProcessPool:
+                record = {'status': 'error', 'error': 'The worker process running the scenario died.'}
+                if future_executor is executor:
+                    executor.shutdown(cancel_futures = True)
+                    executor = ProcessPoolExecutor(num_workers)
+            self.write(line, scenario_id, record)
+        return executor
+
+    def write(self, line, scenario_id, record):
+        # Write the record of a scenario as a line of JSON, and report a failure with its traceback on the standard error
+        self.num_done += 1
+        error_traceback = record.pop('traceback', None)
+        if record['status'] == 'error':
+            self.num_failed += 1
+            self.stderr.write('Scenario %s on line %d failed: %s' % (scenario_id, line, record['error']))
+            if error_traceback and self.verbosity > 1:
+                self.stderr.write(error_traceback)
+        self.output.write(json.dumps({'line': line, 'id': scenario_id, **record}) + '\n')
+        self.output.flush()
@@ -0,0 +1,59 @@
+import json
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+import instrumentation
+
+logger = logging.getLogger('simulations.instrumentation')
+
+class InstrumentationMiddleware:
+    # Record the time every request spends in each phase, and report it in a Server-Timing header and a structured log line
+    # It runs in the same mode as the rest of the chain, so that under ASGI the async views are not pushed through a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        instrumentation.enabled = getattr(settings, 'SIMULATION_INSTRUMENTATION', False)
+        if not instrumentation.enabled:
+            # Leave the middleware out of the request path altogether
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = instrumentation.startRecording()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            recording = instrumentation.finishRecording(token)
+        return self.report(request, response, recording, total)
+
+    async def __acall__(self, request):
+        token = instrumentation.startRecording()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            recording = instrumentation.finishRecording(token)
+        return self.report(request, response, recording, total)
+
+    def report(self, request, response, recording, total):
+        # Add the Server-Timing header to the response and log the request
+        response['Server-Timing'] = instrumentation.serverTiming(recording, total)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 2),
+            'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in recording.phases.items()},
+            'counters': recording.counters,
+        }))
+        return response
@@ -1,3 +1,594 @@
-from django.test import TestCase
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from statistics import NormalDist
+import numpy
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+import instrumentation
+import main
+from agents import AgentStore
+from compartments import MODELS, SEIR, SIR, CompartmentModel, Transition
+from network import ContactGraph, NetworkEngine
+from resultcache import ResultCache
+from .jobs import JobQueue
+from .middleware import InstrumentationMiddleware
 
-# Create your tests here.
+class EngineTests(SimpleTestCase):
+    def test_numpy_engine_keeps_stats_shape(self):
+        stats = main.oneSimulation(30, 1000, 0.1, 0.3, engine = 'numpy')
+        self.assertEqual(len(stats), 30)
+        for day in stats:
+            self.assertEqual(len(day), 3)
+            self.assertEqual(sum(day), 1000)
+
+    def test_multiple_simulations_with_numpy_engine(self):
+        averageDailyStats = main.multipleSimulations(30, 1000, 0.1, 0.3, engine = 'numpy')
+        self.assertEqual(len(averageDailyStats), 30)
+        for day in averageDailyStats:
+            self.assertAlmostEqual(day[0] + day[1] + day[2], 1000)
+            self.assertAlmostEqual(day[3], day[1] / 1000)
+
+    def test_early_end_is_marked_and_not_aliased(self):
+        # With a high recovery probability and a low contact rate the epidemic dies out early
+        stats, absorbedDay = main.activeSimulation(365, 1000, 0.9, 0.1)
+        self.assertEqual(len(stats), absorbedDay)
+        self.assertEqual(stats[-1][1], 0)
+        padded = main.oneSimulation(365, 1000, 0.9, 0.1)
+        self.assertEqual(len(padded), 365)
+        self.assertIsNot(padded[-1], padded[-2])
+        active, absorbedDays = main.activeBatch(365, 1000, 0.9, 0.1, 50, seed = 1)
+        self.assertEqual(active.shape[1], absorbedDays.max())
+        trajectories = main.batchSimulations(365, 1000, 0.9, 0.1, 50, seed = 1)
+        for num in range(50):
+            self.assertTrue((trajectories[num, absorbedDays[num] - 1:] == trajectories[num, -1]).all())
+        # Simulating no days gives no statistics, and no simulation ends
+        active, absorbedDays = main.activeBatch(0, 1000, 0.9, 0.1, 5, seed = 1)
+        self.assertEqual(active.shape, (5, 0, 3))
+        self.assertEqual(absorbedDays.tolist(), [1] * 5)
+        self.assertEqual(main.multipleSimulations(0, 1000, 0.1, 0.3), [])
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            main.oneSimulation(10, 100, 0.1, 0.3, engine = 'unknown')
+
+    def test_binomial_engine_matches_per_person_engine(self):
+        # Compare the number of infectious people on day 20 and the final number of recovered people over many runs of each engine
+        numRuns = 200
+        perPersonRuns = [main.oneSimulation(40, 2000, 0.1, 0.3, engine = 'numpy') for run in range(numRuns)]
+        binomialRuns = [main.oneSimulation(40, 2000, 0.1, 0.3, engine = 'binomial') for run in range(numRuns)]
+        for dayIndex, index in ((19, 1), (39, 2)):
+            perPerson = [stats[dayIndex][index] for stats in perPersonRuns]
+            binomial = [stats[dayIndex][index] for stats in binomialRuns]
+            meanPerPerson = sum(perPerson) / numRuns
+            meanBinomial = sum(binomial) / numRuns
+            variance = (sum((x - meanPerPerson) ** 2 for x in perPerson) + sum((x - meanBinomial) ** 2 for x in binomial)) / (2 * numRuns - 2)
+            standardError = (2 * variance / numRuns) ** 0.5
+            self.assertLess(abs(meanPerPerson - meanBinomial), 4 * standardError + 1)
+
+    def test_simulation_bands(self):
+        bands = main.simulationBands(50, 5000, 0.1, 0.3, numReplicates = 200)
+        self.assertEqual(bands['mean'].shape, (50, 3))
+        self.assertEqual(bands['std'].shape, (50, 3))
+        self.assertTrue((bands['percentiles'][2.5] <= bands['percentiles'][50]).all())
+        self.assertTrue((bands['percentiles'][50] <= bands['percentiles'][97.5]).all())
+
+    def test_results_do_not_depend_on_number_of_workers(self):
+        scenarios = [(60, 5000, 0.1, 0.3), (60, 5000, 0.1, 0.2)]
+        serial = main.runScenarios(scenarios, numReplicates = 150, seed = 7)
+        parallel = main.runScenarios(scenarios, numReplicates = 150, seed = 7, numWorkers = 3)
+        for serialTrajectories, parallelTrajectories in zip(serial, parallel):
+            self.assertTrue((serialTrajectories == parallelTrajectories).all())
+        self.assertFalse((serial[0] == main.runScenarios(scenarios[:1], numReplicates = 150, seed = 8)[0]).all())
+
+    def test_seeded_runs_are_reproducible(self):
+        for engine in ('list', 'numpy', 'binomial', 'coupled', 'gillespie', 'tauleap'):
+            self.assertEqual(main.oneSimulation(30, 500, 0.1, 0.3, engine, seed = 5), main.oneSimulation(30, 500, 0.1, 0.3, engine, seed = 5))
+            self.assertEqual(main.oneSimulation(30, 500, 0.1, 0.3, engine, seed = numpy.random.default_rng(5)), main.oneSimulation(30, 500, 0.1, 0.3, engine, seed = 5))
+        # A generator given as the seed is drawn from once, so the same generator state gives the same results, in series or in parallel
+        serial = main.runScenarios([(60, 5000, 0.1, 0.3)], numReplicates = 100, seed = numpy.random.default_rng(9))[0]
+        parallel = main.runScenarios([(60, 5000, 0.1, 0.3)], numReplicates = 100, seed = numpy.random.default_rng(9), numWorkers = 2)[0]
+        streamed = numpy.stack(list(main.iterScenario(60, 5000, 0.1, 0.3, numReplicates = 100, seed = numpy.random.default_rng(9))), axis = 1)
+        self.assertTrue((serial == parallel).all())
+        self.assertTrue((serial == streamed).all())
+
+    def test_coupled_engine_matches_binomial_engine(self):
+        coupled = main.runScenarios([(60, 5000, 0.1, 0.3)], 'coupled', numReplicates = 400, seed = 1)[0]
+        binomial = main.runScenarios([(60, 5000, 0.1, 0.3)], 'binomial', numReplicates = 400, seed = 1)[0]
+        for dayIndex, index in ((29, 1), (59, 2)):
+            standardError = ((coupled[:, dayIndex, index].var() + binomial[:, dayIndex, index].var()) / 400) ** 0.5
+            self.assertLess(abs(coupled[:, dayIndex, index].mean() - binomial[:, dayIndex, index].mean()), 4 * standardError + 1)
+
+    def test_normal_quantile(self):
+        probs = numpy.concatenate((numpy.random.default_rng(0).random(1000), [1e-12, 0.02425, 0.5, 0.97575, 1 - 1e-12]))
+        expected = numpy.array([NormalDist().inv_cdf(prob) for prob in probs])
+        self.assertTrue(numpy.allclose(main.normalQuantile(probs), expected, rtol = 1e-8, atol = 0))
+
+    def test_paired_comparison_reduces_variance(self):
+        scenarios = [(150, 100000, 0.1, 0.3), (150, 100000, 0.1, 0.25)]
+        comparison = main.pairedComparison(*scenarios, numReplicates = 200, seed = 2)
+        self.assertEqual(comparison['difference'].shape, (150, 3))
+        self.assertTrue((comparison['lower'] <= comparison['difference']).all())
+        self.assertTrue((comparison['difference'] <= comparison['upper']).all())
+        # The difference in peak infections of paired replicates varies much less than that of independent ones
+        independent = main.runScenarios(scenarios, 'coupled', numReplicates = 200, seed = 2)
+        pairedSpread = (comparison['new'][:, :, 1].max(axis = 1) - comparison['old'][:, :, 1].max(axis = 1)).std()
+        independentSpread = (independent[1][:, :, 1].max(axis = 1) - independent[0][:, :, 1].max(axis = 1)).std()
+        self.assertLess(pairedSpread, 0.75 * independentSpread)
+
+    def test_continuous_time_engines_agree(self):
+        # Tau-leaping approximates the exact event-by-event simulation, so their averages over many runs agree
+        exact = main.runScenarios([(100, 3000, 0.1, 0.3)], 'gillespie', numReplicates = 100, seed = 6)[0]
+        leaped = main.runScenarios([(100, 3000, 0.1, 0.3)], 'tauleap', numReplicates = 100, seed = 6)[0]
+        for trajectories in (exact, leaped):
+            self.assertEqual(trajectories.shape, (100, 100, 3))
+            self.assertTrue((trajectories.sum(axis = 2) == 3000).all())
+        for dayIndex, index in ((29, 1), (99, 2)):
+            standardError = ((exact[:, dayIndex, index].var() + leaped[:, dayIndex, index].var()) / 100) ** 0.5
+            self.assertLess(abs(exact[:, dayIndex, index].mean() - leaped[:, dayIndex, index].mean()), 4 * standardError + 1)
+
+    def test_agent_store(self):
+        # The agent store draws the same random numbers as the NumPy engine, so it gives the same results for the same seed
+        self.assertEqual(main.oneSimulation(60, 2000, 0.1, 0.3, 'agents', seed = 3), main.oneSimulation(60, 2000, 0.1, 0.3, 'numpy', seed = 3))
+        agents = AgentStore(1000)
+        agents.step(0.1, 0.3, numpy.random.default_rng(0), 1)
+        self.assertEqual(sum(agents.counts()), 1000)
+        self.assertEqual(int(numpy.count_nonzero(agents.infectionDay == 1)), 1000 - agents.counts()[0] - 5)
+        # Every agent takes the same number of bytes, whatever the size of the population
+        agents.addAttribute('age', numpy.uint8)
+        self.assertEqual(agents.nbytes, 1000 * 16)
+        self.assertEqual(AgentStore(100000).nbytes, 100000 * 15)
+
+    def test_network_engine(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # On a complete graph, the network engine is the model with homogeneous mixing
+            sources, targets = numpy.triu_indices(300, 1)
+            path = os.path.join(directory, "edges.txt")
+            numpy.savetxt(path, numpy.column_stack((sources, targets)), fmt = '%d')
+            graph = ContactGraph.fromEdgeList(path)
+            self.assertEqual((graph.numNodes, graph.numEdges), (300, 300 * 299 // 2))
+            self.assertTrue((graph.degrees() == 299).all())
+            graph.save(os.path.join(directory, "graph"))
+            engine = NetworkEngine(os.path.join(directory, "graph"))
+            network = main.runScenarios([(60, 300, 0.1, 0.3)], engine, numReplicates = 200, seed = 1, numWorkers = 2)[0]
+            homogeneous = main.runScenarios([(60, 300, 0.1, 0.3)], 'numpy', numReplicates = 200, seed = 1)[0]
+            for dayIndex, index in ((19, 1), (59, 2)):
+                standardError = ((network[:, dayIndex, index].var() + homogeneous[:, dayIndex, index].var()) / 200) ** 0.5
+                self.assertLess(abs(network[:, dayIndex, index].mean() - homogeneous[:, dayIndex, index].mean()), 4 * standardError + 1)
+            # A smaller population takes the first people of the graph
+            stats = main.multipleSimulations(30, 100, 0.1, 0.3, engine, seed = 2)
+            self.assertAlmostEqual(sum(stats[-1][:3]), 100)
+            with self.assertRaises(ValueError):
+                main.oneSimulation(30, 301, 0.1, 0.3, engine)
+
+    def test_metapopulation(self):
+        # A single region is the binomial engine, drawing the same random numbers
+        days = list(main.metapopulationSteps(60, [5000], [0.1], [0.3], numpy.eye(1), seed = 3))
+        self.assertEqual([stats[0, 0].tolist() for stats in days], main.oneSimulation(60, 5000, 0.1, 0.3, 'binomial', seed = 3)[:len(days)])
+        # The infection only reaches the second region if people travel between the regions
+        isolated = main.metapopulationSimulations(100, [5000, 5000], 0.1, 0.3, numpy.eye(2), numReplicates = 20, seed = 4, numInfectious = [5, 0])
+        connected = main.metapopulationSimulations(100, [5000, 5000], 0.1, 0.3, [[0.9, 0.1], [0.1, 0.9]], numReplicates = 20, seed = 4, numInfectious = [5, 0])
+        self.assertEqual(isolated['regions'].shape, (100, 2, 4))
+        self.assertEqual(isolated['regions'][-1, 1, 2], 0)
+        self.assertGreater(connected['regions'][-1, 1, 2], 1000)
+        self.assertAlmostEqual(sum(connected['total'][-1][:3]), 10000)
+        with self.assertRaises(ValueError):
+            main.metapopulationSimulations(10, [5000, 5000], 0.1, 0.3, [[0.5, 0.4], [0.1, 0.9]])
+
+    def test_deterministic_engines(self):
+        meanField = main.multipleSimulations(150, 100000, 0.1, 0.3, engine = 'meanfield')
+        rk45 = main.deterministicStats(150, 100000, 0.1, 0.3, engine = 'rk45')
+        self.assertEqual(len(meanField), 150)
+        self.assertEqual(len(rk45), 150)
+        for stats in meanField + rk45:
+            self.assertAlmostEqual(stats[0] + stats[1] + stats[2], 100000, places = 3)
+            self.assertAlmostEqual(stats[3], stats[1] / 100000)
+        # The daily map and the differential equations describe the same epidemic, whose final size is close to that of the simulations
+        simulated = main.multipleSimulations(150, 100000, 0.1, 0.3, numReplicates = 50, seed = 4)
+        self.assertLess(abs(meanField[-1][2] - simulated[-1][2]), 0.05 * 100000)
+        self.assertLess(abs(rk45[-1][2] - simulated[-1][2]), 0.05 * 100000)
+
+    def test_adaptive_replicates(self):
+        # A large outbreak varies little, so the first batch is enough; a small one needs more replicates for the same precision
+        easy = main.adaptiveSimulations(60, 100000, 0.1, 0.5, tolerance = 0.01, seed = 1)
+        hard = main.adaptiveSimulations(60, 1000, 0.1, 0.15, tolerance = 0.01, seed = 1)
+        self.assertTrue(easy['converged'] and hard['converged'])
+        self.assertEqual(easy['numReplicates'], 5)
+        self.assertGreater(hard['numReplicates'], 5)
+        self.assertLessEqual(hard['finalRecovered'][1], 0.01)
+        self.assertLessEqual(hard['peakInfections'][1], 0.01 * 1000)
+        self.assertEqual(len(hard['stats']), 60)
+        # The time budget stops an unreachable precision
+        with tempfile.TemporaryDirectory() as directory:
+            cache = main.resultCache
+            main.resultCache = ResultCache(directory)
+            try:
+                limited = main.adaptiveSimulations(60, 1000, 0.1, 0.3, tolerance = 1e-4, timeBudget = 0.2, seed = 1)
+                # It depends on how fast the batches ran, so it is not cached even with a seed
+                self.assertEqual(len(main.resultCache.memory), 0)
+            finally:
+                main.resultCache = cache
+        self.assertFalse(limited['converged'])
+        self.assertLess(limited['seconds'], 2)
+        with self.assertRaises(ValueError):
+            main.adaptiveSimulations(60, 1000, 0.1, 0.3, tolerance = 0)
+        self.assertEqual(main.adaptiveSimulations(60, 1000, 0.1, 0.3, engine = 'meanfield')['numReplicates'], 0)
+
+    def test_trajectory_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trajectories.npy")
+            expected = main.runScenarios([(40, 1000, 0.1, 0.3)], 'binomial', 150, 7)[0]
+            average = main.multipleSimulations(40, 1000, 0.1, 0.3, numReplicates = 150, seed = 7, trajectoryFile = path)
+            self.assertTrue(numpy.allclose(average, main.averageStats(expected, 1000)))
+            # The file is mapped, not read, and holds the same replicates as runScenarios
+            trajectories = main.openTrajectories(path)
+            self.assertIsInstance(trajectories, numpy.memmap)
+            self.assertEqual(trajectories.dtype, numpy.int32)
+            self.assertTrue((trajectories == expected).all())
+            # Reductions over small chunks agree with the ones over the whole array
+            self.assertTrue(numpy.allclose(main.trajectoryAverage(trajectories, 1000, chunkReplicates = 16), average))
+            metrics = main.trajectoryMetrics(trajectories, 1000, chunkReplicates = 16)
+            for name, value in main.summaryMetrics(expected, 1000).items():
+                self.assertAlmostEqual(metrics[name], value)
+            bands = main.trajectoryBands(trajectories, chunkBytes = 4096)
+            self.assertTrue(numpy.allclose(bands['std'], expected.std(axis = 0)))
+            self.assertTrue(numpy.allclose(bands['percentiles'][97.5], numpy.percentile(expected, 97.5, axis = 0)))
+
+    def test_compartment_models(self):
+        # The SIR model of the kernel draws the same numbers as the single-run binomial engine
+        self.assertEqual(list(SIR(80, 5000, 0.1, 0.3, numpy.random.default_rng(2))), list(main.binomialSteps(80, 5000, 0.1, 0.3, numpy.random.default_rng(2))))
+        for name in ('seir', 'sirs', 'sirv'):
+            counts = numpy.array(list(MODELS[name].compartmentSteps(100, 10000, 0.1, 0.3, 16, numpy.random.default_rng(1))))
+            self.assertTrue((counts.sum(axis = 2) == 10000).all())
+            self.assertTrue((counts >= 0).all())
+        sir = main.summaryMetrics(main.runScenarios([(150, 100000, 0.1, 0.3)], 'binomial', 20, 1)[0], 100000)
+        seir = main.summaryMetrics(main.runScenarios([(150, 100000, 0.1, 0.3)], 'seir', 20, 1)[0], 100000)
+        sirv = main.summaryMetrics(main.runScenarios([(150, 100000, 0.1, 0.3)], 'sirv', 20, 1)[0], 100000)
+        # Being exposed before being infectious delays the peak, and vaccination reduces it
+        self.assertGreater(seir['peakDay'], sir['peakDay'])
+        self.assertLess(sirv['peakInfections'], sir['peakInfections'])
+        # Waning immunity brings people back to the susceptible compartment, so the epidemic becomes endemic
+        sirs = main.multipleSimulations(400, 100000, 0.1, 0.3, 'sirs', seed = 1)
+        self.assertGreater(sirs[-1][1], 0)
+        self.assertGreater(sirs[-1][0], min(day[0] for day in sirs) + 10000)
+        # A model given as the engine gets the same results whatever the number of workers
+        model = SEIR.withParameters(incubationProb = 0.5)
+        self.assertEqual(main.multipleSimulations(60, 1000, 0.1, 0.3, model, 70, seed = 3), main.multipleSimulations(60, 1000, 0.1, 0.3, model, 70, seed = 3, numWorkers = 2))
+        self.assertNotEqual(repr(model), repr(SEIR))
+        with self.assertRaises(ValueError):
+            CompartmentModel('si', ['S', 'I'], [Transition('S', 'I', 'infectionProb')], (['S'], ['I'], []), (['S'],))
+
+    def test_parameter_sweep_resumes(self):
+        with tempfile.TemporaryDirectory() as outputDir:
+            sweep = main.parameterSweep(60, [1000], [0.1, 0.2], [0.3, 0.5, 0.7], outputDir, seed = 3)
+            self.assertEqual(len(sweep['peakInfections']), 6)
+            self.assertTrue(((sweep['finalAttackRate'] >= 0) & (sweep['finalAttackRate'] <= 1)).all())
+            # Remove one point as if the sweep had been interrupted; running it again only simulates that point
+            os.remove(os.path.join(outputDir, "point_000004.npz"))
+            resumed = main.parameterSweep(60, [1000], [0.1, 0.2], [0.3, 0.5, 0.7], outputDir, seed = 3)
+            for name in main.SWEEP_COLUMNS:
+                self.assertEqual(resumed[name].tolist(), sweep[name].tolist())
+            # Points run with another seed or engine are simulated again, and the points of the larger grid left in the directory are not returned
+            with tempfile.TemporaryDirectory() as otherDir:
+                for engine, seed in (('binomial', 4), ('numpy', 4)):
+                    rerun = main.parameterSweep(60, [1000], [0.1], [0.3], outputDir, engine = engine, seed = seed)
+                    self.assertEqual(len(rerun['peakInfections']), 1)
+                    self.assertEqual(rerun['peakInfections'].tolist(), main.parameterSweep(60, [1000], [0.1], [0.3], os.path.join(otherDir, engine), engine = engine, seed = seed)['peakInfections'].tolist())
+
+class ResultCacheTests(SimpleTestCase):
+    def test_memory_and_disk_tiers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory, maxMemoryItems = 1, maxDiskBytes = 25)
+            cache.set('a' * 64, b'0123456789')
+            cache.set('b' * 64, b'0123456789')
+            self.assertEqual(cache.get('b' * 64), b'0123456789')
+            # The first value was dropped from memory but is still on disk
+            self.assertEqual(cache.get('a' * 64), b'0123456789')
+            # A third value goes over the size of the disk tier, so the least recently used file is removed
+            os.utime(cache.path('b' * 64), (0, 0))
+            cache.set('c' * 64, b'0123456789')
+            cache.memory.clear()
+            self.assertIsNone(cache.get('b' * 64))
+            self.assertEqual(cache.get('a' * 64), b'0123456789')
+            self.assertEqual(cache.get('c' * 64), b'0123456789')
+
+    def test_disk_tier_is_scanned_only_over_its_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory, maxDiskBytes = 100)
+            scans = []
+            evict = cache.evict
+            cache.evict = lambda: scans.append(1) or evict()
+            for index in range(9):
+                cache.set('%064d' % index, b'0123456789')
+            # Only the first value scans the files, to count their size; replacing a value counts the difference
+            cache.set('%064d' % 0, b'01234567890123456789')
+            self.assertEqual((len(scans), cache.diskBytes), (1, 100))
+            cache.set('%064d' % 9, b'0123456789')
+            self.assertEqual(len(scans), 2)
+            self.assertLessEqual(cache.diskBytes, 100)
+            self.assertEqual(cache.diskBytes, sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(directory) for name in names))
+
+    def test_seeded_simulations_are_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = main.resultCache
+            main.resultCache = ResultCache(directory)
+            try:
+                first = main.multipleSimulations(40, 1000, 0.1, 0.3, seed = 11)
+                self.assertEqual(len(main.resultCache.memory), 1)
+                self.assertEqual(main.multipleSimulations(40, 1000, 0.1, 0.3, seed = 11), first)
+            finally:
+                main.resultCache = cache
+
+    def test_comparisons_reuse_the_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache, runScenarios = main.resultCache, main.runScenarios
+            simulated = []
+            def recordScenarios(scenarios, *args, **kwargs):
+                simulated.append(list(scenarios))
+                return runScenarios(scenarios, *args, **kwargs)
+            try:
+                main.resultCache = ResultCache(os.path.join(directory, 'cold'))
+                expected = main.strategy1Graph(40, 1000, 0.1, 0.3, 0.2, seed = 11, filename = None)
+                main.resultCache = ResultCache(os.path.join(directory, 'warm'))
+                main.runScenarios = recordScenarios
+                baseline = main.multipleSimulations(40, 1000, 0.1, 0.3, seed = 11)
+                # Only the new scenario is simulated, and the graph is the same as when both are
+                self.assertEqual(main.strategy1Graph(40, 1000, 0.1, 0.3, 0.2, seed = 11, filename = None), expected)
+                self.assertEqual(simulated[1:], [[(40, 1000, 0.1, 0.2)]])
+                # Statistics given directly are used even without a seed
+                main.strategy2Graph(40, 1000, 0.1, 0.3, 0.2, filename = None, old_stats = baseline)
+                self.assertEqual(simulated[2:], [[(40, 1000, 0.2, 0.3)]])
+            finally:
+                main.resultCache, main.runScenarios = cache, runScenarios
+
+    def test_paired_and_unpaired_graphs_are_cached_apart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = main.resultCache
+            main.resultCache = ResultCache(directory)
+            try:
+                paired = main.strategy1Graph(40, 1000, 0.1, 0.3, 0.2, seed = 1, filename = None, paired = True, engine = 'numpy')
+                self.assertNotEqual(main.strategy1Graph(40, 1000, 0.1, 0.3, 0.2, seed = 1, filename = None, engine = 'numpy'), paired)
+            finally:
+                main.resultCache = cache
+
+class ViewTests(TestCase):
+    def setUp(self):
+        # Keep the results of the views out of the cache of the project
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = main.resultCache
+        main.resultCache = ResultCache(directory.name)
+        self.addCleanup(setattr, main, 'resultCache', cache)
+
+    def test_baseline_graph_is_served_by_content_hash(self):
+        response = self.client.post('/result/', {'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'baseline_submitted': '1'})
+        self.assertEqual(response.status_code, 200)
+        graph = response.context['graph']
+        self.assertContains(response, '/graph/' + graph + '.png')
+        image = self.client.get('/graph/' + graph + '.png')
+        self.assertEqual(image['Content-Type'], 'image/png')
+        self.assertIn('immutable', image['Cache-Control'])
+        # Showing the baseline again renders the same graph
+        self.assertEqual(self.client.get('/result/').context['graph'], graph)
+
+    def test_adaptive_baseline_reports_precision(self):
+        response = self.client.post('/result/', {'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'tolerance': 0.02, 'time_budget': 5, 'baseline_submitted': '1'})
+        precision = response.context['precision']
+        self.assertGreaterEqual(precision['num_replicates'], 5)
+        self.assertContains(response, '%d replicates' % precision['num_replicates'])
+        # Showing the baseline again reuses the seeded result
+        again = self.client.get('/result/')
+        self.assertEqual(again.context['graph'], response.context['graph'])
+        self.assertEqual(again.context['precision'], precision)
+        # The strategies are compared with the statistics of the adaptive baseline that was shown, even when the time budget ran out
+        response = self.client.post('/result/', {'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'tolerance': 0.0001, 'time_budget': 0.1, 'baseline_submitted': '1'})
+        self.assertFalse(response.context['precision']['converged'])
+        rendered = []
+        renderGraph = main.renderGraph
+        def recordGraph(*stats):
+            rendered.append(stats)
+            return renderGraph(*stats)
+        main.renderGraph = recordGraph
+        try:
+            self.client.post('/result/', {'strategy': 'strategy1', 'new_contactRate': '0.2'})
+            self.client.get('/result/')
+        finally:
+            main.renderGraph = renderGraph
+        self.assertEqual(rendered[0][0], rendered[1][0])
+
+    def test_out_of_range_probabilities_are_rejected(self):
+        for field, value in (('recover_prob', 1.5), ('recover_prob', -0.1), ('contact_rate', -0.2)):
+            data = {'baseline_submitted': '1', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, field: value}
+            response = self.client.post('/result/', data)
+            self.assertEqual(response.status_code, 200)
+            self.assertTemplateUsed(response, 'index.html')
+            self.assertIn(field, response.context['form'].errors)
+
+    def test_preview(self):
+        response = self.client.get('/preview/', {'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['stats']), 30)
+        self.assertEqual(self.client.get('/preview/', {'num_days': 30}).status_code, 400)
+
+    @override_settings(SIMULATION_INSTRUMENTATION = True)
+    def test_instrumentation(self):
+        # The middleware reads the setting when it is loaded, and sets whether the timers record for the whole process
+        self.addCleanup(setattr, instrumentation, 'enabled', False)
+        with self.assertLogs('simulations.instrumentation', 'INFO') as logs:
+            response = self.client.post('/result/', {'baseline_submitted': '1', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3})
+        timing = response['Server-Timing']
+        for phase in ('form', 'simulate', 'average', 'layout', 'encode', 'total'):
+            self.assertIn(phase + ';dur=', timing)
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['path'], '/result/')
+        self.assertEqual(line['counters']['replicates'], 5)
+        self.assertEqual(line['counters']['person_days'] % 1000, 0)
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('sir_phase_seconds_total{phase="simulate"}', metrics)
+        self.assertIn('sir_person_days_total', metrics)
+        # In front of an async view, as under ASGI, the middleware is async too, so the view runs in the event loop
+        async def view(request):
+            return HttpResponse()
+        middleware = InstrumentationMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('simulations.instrumentation', 'INFO'):
+            self.assertIn('total;dur=', async_to_sync(middleware)(RequestFactory().get('/jobs/'))['Server-Timing'])
+
+    def test_unknown_graph(self):
+        self.assertEqual(self.client.get('/graph/' + '0' * 64 + '.png').status_code, 404)
+
+    def test_jobs(self):
+        response = self.client.post('/jobs/', {'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'baseline_submitted': '1'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        for attempt in range(100):
+            status = self.client.get(status_url).json()
+            if status['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['progress'], 1.0)
+        self.assertEqual(self.client.get(status['graph_url'])['Content-Type'], 'image/png')
+        self.assertEqual(self.client.post('/jobs/', {'strategy': 'strategy1'}).status_code, 400)
+
+    def test_stream(self):
+        response = self.client.post('/result/', {'num_days': 20, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'baseline_submitted': '1', 'live': '1'})
+        self.assertContains(response, 'data-stream-url="/stream/"')
+        response = self.client.get('/stream/?strategy=strategy1&new_value=0.2')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode().split('\n\n')
+        self.assertEqual(events[-2], 'event: done\ndata: {}')
+        first_day = json.loads(events[0][len('data: '):])
+        self.assertEqual(first_day['day'], 1)
+        self.assertEqual(len(first_day['stats']), 2)
+        self.assertEqual(len(events), 22)
+        # Invalid new values are rejected before the stream starts
+        for strategy, new_value in (('strategy3', '0'), ('strategy3', '-5'), ('strategy2', '7'), ('strategy1', 'fast')):
+            response = self.client.get('/stream/', {'strategy': strategy, 'new_value': new_value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+class BenchmarkTests(SimpleTestCase):
+    def test_benchmark_records_history_and_flags_regressions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            history = os.path.join(directory, "history.json")
+            baseline = os.path.join(directory, "baseline.json")
+            options = {'sizes': [1000], 'days': [20], 'replicates': [2], 'engines': ['binomial', 'meanfield'], 'repeats': 1, 'history': history, 'stdout': io.StringIO()}
+            call_command('benchmark', save_baseline = baseline, **options)
+            with open(history) as file:
+                runs = json.load(file)
+            self.assertEqual(len(runs), 1)
+            self.assertEqual({result['function'] for result in runs[0]['results']}, {'oneSimulation', 'multipleSimulations', 'createGraph', 'result', 'startup'})
+            self.assertTrue(all(result['personDaysPerSecond'] > 0 for result in runs[0]['results'] if result['function'] != 'startup'))
+            # A baseline that was much faster makes the comparison fail
+            with open(baseline) as file:
+                run = json.load(file)
+            for result in run['results']:
+                result['latencyMs']['p50'] = result['latencyMs']['p50'] / 100
+            with open(baseline, 'w') as file:
+                json.dump(run, file)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', compare = baseline, **options)
+            with open(history) as file:
+                self.assertEqual(len(json.load(file)), 2)
+
+class RunScenariosTests(SimpleTestCase):
+    def test_scenarios_run_in_a_pool_and_failures_are_isolated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scenarios = os.path.join(directory, "scenarios.jsonl")
+            with open(scenarios, 'w') as file:
+                file.write(json.dumps({'id': 'baseline', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'seed': 4}) + '\n')
+                file.write(json.dumps({'id': 'strategy', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'seed': 4, 'strategy': 'strategy1', 'new_contactRate': 0.2}) + '\n')
+                file.write(json.dumps({'num_days': 30, 'population': 'many', 'recover_prob': 0.1, 'contact_rate': 0.3}) + '\n')
+                file.write('\n')
+                file.write(json.dumps({'id': 'list-engine', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'engine': ['numpy']}) + '\n')
+                file.write(json.dumps({'id': 'bool-replicates', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'replicates': True}) + '\n')
+                file.write(json.dumps({'id': 'list-new-value', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'strategy': 'strategy1', 'new_contactRate': [0.2]}) + '\n')
+                file.write(json.dumps({'id': 'bool-seed', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'seed': True}) + '\n')
+                file.write(json.dumps({'id': 'meanfield', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3, 'engine': 'meanfield'}) + '\n')
+            for workers in (1, 2):
+                output = os.path.join(directory, "results-%d.jsonl" % workers)
+                call_command('runscenarios', scenarios, output = output, workers = workers, stdout = io.StringIO(), stderr = io.StringIO())
+                with open(output) as file:
+                    records = {record['id']: record for record in map(json.loads, file)}
+                self.assertEqual(set(records), {'baseline', 'strategy', 'line-3', 'list-engine', 'bool-replicates', 'list-new-value', 'bool-seed', 'meanfield'})
+                for scenario_id in ('line-3', 'list-engine', 'bool-replicates', 'list-new-value', 'bool-seed'):
+                    self.assertEqual(records[scenario_id]['status'], 'error')
+                self.assertIn('population', records['line-3']['error'])
+                self.assertEqual(records['strategy']['baseline'], records['baseline']['baseline'])
+                self.assertLess(records['strategy']['strategy']['peakInfections'], records['strategy']['baseline']['peakInfections'])
+                self.assertEqual(records['meanfield']['status'], 'ok')
+
+    def test_scenarios_that_fail_while_running_are_isolated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scenarios = os.path.join(directory, "scenarios.jsonl")
+            with open(scenarios, 'w') as file:
+                file.write(json.dumps({'id': 'empty', 'num_days': 30, 'population': 0, 'recover_prob': 0.1, 'contact_rate': 0.3}) + '\n')
+                file.write(json.dumps({'id': 'ok', 'num_days': 30, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3}) + '\n')
+            for workers in (1, 2):
+                for verbosity in (1, 2):
+                    stdout = io.StringIO()
+                    stderr = io.StringIO()
+                    call_command('runscenarios', scenarios, workers = workers, verbosity = verbosity, stdout = stdout, stderr = stderr)
+                    records = {record['id']: record for record in map(json.loads, stdout.getvalue().splitlines())}
+                    self.assertEqual(records['empty']['status'], 'error')
+                    self.assertEqual(records['ok']['status'], 'ok')
+                    self.assertEqual('Traceback' in stderr.getvalue(), verbosity > 1)
+
+    def test_charts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scenarios = os.path.join(directory, "scenarios.jsonl")
+            with open(scenarios, 'w') as file:
+                file.write(json.dumps({'id': 'a/b', 'num_days': 20, 'population': 1000, 'recover_prob': 0.1, 'contact_rate': 0.3}) + '\n')
+            stdout = io.StringIO()
+            call_command('runscenarios', scenarios, workers = 1, charts = directory, daily = True, stdout = stdout, stderr = io.StringIO())
+            record = json.loads(stdout.getvalue())
+            self.assertEqual(len(record['baseline']['stats']), 20)
+            with open(record['chart'], 'rb') as file:
+                self.assertEqual(file.read(8), b'\x89PNG\r\n\x1a\n')
+
+class StartupTests(SimpleTestCase):
+    def loaded_modules(self, code):
+        # Run the code in a fresh interpreter and report whether it imported the simulation engines and matplotlib
+        code += "\nimport sys\nprint(' '.join(name for name in ('main', 'numpy', 'matplotlib') if name in sys.modules))"
+        output = subprocess.run([sys.executable, '-c', code], cwd = settings.BASE_DIR, env = dict(os.environ, DJANGO_SETTINGS_MODULE = 'sir_simulator.settings'), capture_output = True, text = True, check = True).stdout
+        return set(output.split())
+
+    def test_engines_are_imported_on_first_use(self):
+        self.assertEqual(self.loaded_modules('import main'), {'main', 'numpy'})
+        self.assertEqual(self.loaded_modules(
+            'from sir_simulator.wsgi import application\n'
+            'from wsgiref.util import setup_testing_defaults\n'
+            'environ = {}\n'
+            'setup_testing_defaults(environ)\n'
+            'application(environ, lambda status, headers: None)'
+        ), set())
+
+    def test_warm_up(self):
+        self.assertEqual(self.loaded_modules('from django.conf import settings\nsettings.SIMULATION_WARM_UP = False\nfrom sir_simulator.wsgi import application'), set())
+        self.assertEqual(self.loaded_modules('from django.conf import settings\nsettings.SIMULATION_WARM_UP = True\nfrom sir_simulator.wsgi import application'), {'main', 'numpy', 'matplotlib'})
+
+class JobQueueTests(SimpleTestCase):
+    def test_identical_jobs_in_flight_are_deduplicated(self):
+        queue = JobQueue(1)
+        release = threading.Event()
+
+        def wait(progress):
+            release.wait(5)
+            return 'result'
+
+        job_id = queue.submit('key', wait)
+        self.assertEqual(queue.submit('key', wait), job_id)
+        release.set()
+        queue.executor.shutdown(wait = True)
+        self.assertEqual(queue.status(job_id)['result'], 'result')
+        self.assertNotIn('key', queue.in_flight)
@@ -4,4 +4,10 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('result/', views.result, name='result'),
+    path('preview/', views.preview, name='preview'),
+    path('graph/<str:name>.png', views.graph, name='graph'),
+    path('stream/', views.stream, name='stream'),
+    path('jobs/', views.submit_job, name='submit_job'),
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,6 +1,125 @@
+import json
+import random
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET, require_POST
 from .forms import SimulationForm
-import main
+from .jobs import job_queue
+import instrumentation
+
+# main, which imports NumPy and the simulation engines, is imported by the views that use it rather than here, so that the server starts and serves the index page without loading it; SIMULATION_WARM_UP loads it before the first request instead
+
+def baseline_context(baseline):
+    # Render the baseline graph, which comes from the cache when the baseline is seeded, and store it under its content hash
+    # In adaptive mode, also report the precision reached with the number of replicates run
+    import main
+    scenario = (baseline['num_days'], baseline['population'], baseline['recover_prob'], baseline['contact_rate'])
+    if not baseline.get('tolerance'):
+        return {'graph': main.storeGraph(main.normalGraph(*scenario, seed = baseline.get('seed'), filename = None))}
+    time_budget = baseline.get('time_budget') or main.ADAPTIVE_TIME_BUDGET
+    result = adaptive_result(baseline)
+    return {
+        'graph': main.storeGraph(main.renderGraph(result['stats'])),
+        'precision': {
+            'num_replicates': result['numReplicates'],
+            'peak': result['peakInfections'][0],
+            'peak_margin': result['peakInfections'][1],
+            'final': result['finalRecovered'][0] * 100,
+            'final_margin': result['finalRecovered'][1] * 100,
+            'converged': result['converged'],
+            'time_budget': time_budget,
+        },
+    }
+
+def adaptive_result(baseline):
+    # Run the adaptive baseline, or reuse its result: one that ran out of its time budget depends on how fast it ran, so it is kept under the key of this baseline, whose seed is drawn for every submission, for its graph and the strategies compared with it to show the same statistics
+    import main
+    key = main.cacheKey('adaptiveBaseline', sorted(baseline.items()))
+    cached = main.resultCache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    scenario = (baseline['num_days'], baseline['population'], baseline['recover_prob'], baseline['contact_rate'])
+    result = main.adaptiveSimulations(*scenario, tolerance = baseline['tolerance'], timeBudget = baseline.get('time_budget') or main.ADAPTIVE_TIME_BUDGET, seed = baseline.get('seed'))
+    main.resultCache.set(key, json.dumps(result).encode())
+    return result
+
+def parse_strategy(post):
+    # Read the new value of the selected strategy; return the graph function of the strategy and the new value, or None and an error message
+    import main
+    strategy = post.get('strategy')
+
+    if strategy == 'strategy1':  # Contact rate change
+        new_val = post.get('new_contactRate')
+        if not new_val:
+            return None, None, 'Please enter a new contact rate.'
+        try:
+            new_contact_rate = float(new_val)
+        except ValueError:
+            return None, None, 'Please enter a valid number for the contact rate.'
+        if not 0 < new_contact_rate < 1:
+            return None, None, 'Contact rate must be between 0 and 1.'
+        return main.strategy1Graph, new_contact_rate, None
+
+    elif strategy == 'strategy2':  # Recovery probability change
+        new_val = post.get('new_recoverProb')
+        if not new_val:
+            return None, None, 'Please enter a new recovery probability.'
+        try:
+            new_recover_prob = float(new_val)
+        except ValueError:
+            return None, None, 'Please enter a valid number for the recovery probability.'
+        if not 0 < new_recover_prob < 1:
+            return None, None, 'Recovery probability must be between 0 and 1.'
+        return main.strategy2Graph, new_recover_prob, None
+
+    elif strategy == 'strategy3':  # Population size change
+        new_val = post.get('new_numPeople')
+        if not new_val:
+            return None, None, 'Please enter a new susceptible population size.'
+        try:
+            new_population = int(new_val)
+        except ValueError:
+            return None, None, 'Please enter a valid number for the population size.'
+        if not new_population > 0:
+            return None, None, 'Population size must be a positive integer.'
+        return main.strategy3Graph, new_population, None
+
+    # No strategy selected yet
+    return None, None, None
+
+def graph(request, name):
+    # Serve a rendered graph; its name is the hash of its content, so it never changes and browsers can keep it
+    import main
+    png = main.loadGraph(name)
+    if png is None:
+        raise Http404('Graph not found.')
+    response = HttpResponse(png, content_type = 'image/png')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response['ETag'] = '"' + name + '"'
+    return response
+
+@require_GET
+def preview(request):
+    # Compute the mean-field limit of the model for the values in the query string; it takes well under a millisecond, so the form can show it while it is filled in
+    import main
+    form = SimulationForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status = 400)
+    stats = main.deterministicStats(
+        form.cleaned_data['num_days'], form.cleaned_data['population'],
+        form.cleaned_data['recover_prob'], form.cleaned_data['contact_rate']
+    )
+    return JsonResponse({'stats': stats})
+
+@require_GET
+def metrics(request):
+    # Totals of the instrumentation timers and counters in the Prometheus text format, for scraping
+    return HttpResponse(instrumentation.prometheusText(), content_type = 'text/plain; version=0.0.4')
 
 def index(request):
     # Initial page with form
@@ -8,28 +127,42 @@ def index(request):
     return render(request, 'index.html', {'form': form})
 
 def result(request):
+    import main
     if request.method == 'POST':
         # Run baseline
         if 'baseline_submitted' in request.POST:
-            form = SimulationForm(request.POST)
-            if form.is_valid():
+            with instrumentation.timer('form'):
+                form = SimulationForm(request.POST)
+                valid = form.is_valid()
+            if valid:
                 num_days = form.cleaned_data['num_days']
                 population = form.cleaned_data['population']
                 recover_prob = form.cleaned_data['recover_prob']
                 contact_rate = form.cleaned_data['contact_rate']
 
-                main.normalGraph(num_days, population, recover_prob, contact_rate)
-
-                # Store baseline in session
-                request.session['baseline'] = {
+                # Store baseline in session, seeded so that its graph can be served from the cache when it is shown again
+                baseline = {
                     'num_days': num_days,
                     'population': population,
                     'recover_prob': recover_prob,
                     'contact_rate': contact_rate,
+                    'tolerance': form.cleaned_data.get('tolerance'),
+                    'time_budget': form.cleaned_data.get('time_budget'),
+                    'seed': random.randrange(2 ** 32),
                 }
+                request.session['baseline'] = baseline
+
+                # Draw the baseline in the browser as it is simulated instead of rendering a graph
+                if 'live' in request.POST:
+                    return render(request, 'result.html', {
+                        'stream_url': reverse('stream'),
+                        'baseline': baseline,
+                        'live': True,
+                        'show_strategy_options': True
+                    })
 
                 return render(request, 'result.html', {
-                    'img_path': 'normal_graph.png',
+                    **baseline_context(baseline),
                     'show_strategy_options': True
                 })
             else:
@@ -42,80 +175,49 @@ def result(request):
                 return redirect('index')
 
             strategy = request.POST.get('strategy')
-            img_path = None
-            error = None
-
-            # Handle each strategy
-            if strategy == 'strategy1':
-                new_val = request.POST.get('new_contactRate')
-                if new_val:
-                    try:
-                        new_contact_rate = float(new_val)
-                        if 0 < new_contact_rate < 1:
-                            main.strategy1Graph(
-                                baseline['num_days'], baseline['population'],
-                                baseline['recover_prob'], baseline['contact_rate'],
-                                new_contact_rate
-                            )
-                            img_path = 'strategy1_graph.png'
-                        else:
-                            error = 'Contact rate must be between 0 and 1.'
-                    except ValueError:
-                        error = 'Please enter a valid number for the contact rate.'
-                else:
-                    error = 'Please enter a new contact rate.'
-
-            elif strategy == 'strategy2':  # Recovery probability change
-                new_val = request.POST.get('new_recoverProb')
-                if new_val:
-                    try:
-                        new_recover_prob = float(new_val)
-                        if 0 < new_recover_prob < 1:
-                            main.strategy2Graph(
-                                baseline['num_days'], baseline['population'],
-                                baseline['recover_prob'], baseline['contact_rate'],
-                                new_recover_prob
-                            )
-                            img_path = 'strategy2_graph.png'
-                        else:
-                            error = 'Recovery probability must be between 0 and 1.'
-                    except ValueError:
-                        error = 'Please enter a valid number for the recovery probability.'
-                else:
-                    error = 'Please enter a new recovery probability.'
-
-            elif strategy == 'strategy3':  # Population size change
-                new_val = request.POST.get('new_numPeople')
-                if new_val:
-                    try:
-                        new_population = int(new_val)
-                        if new_population > 0:
-                            main.strategy3Graph(
-                                baseline['num_days'], baseline['population'],
-                                baseline['recover_prob'], baseline['contact_rate'],
-                                new_population
-                            )
-                            img_path = 'strategy3_graph.png'
-                        else:
-                            error = 'Population size must be a positive integer.'
-                    except ValueError:
-                        error = 'Please enter a valid number for the population size.'
-                else:
-                    error = 'Please enter a new susceptible population size.'
+            with instrumentation.timer('form'):
+                graph_function, new_value, error = parse_strategy(request.POST)
 
-            # Return with error message or show the graph for the selected strategy
-            if error:
+            # Return with error message if the new value is missing or invalid
+            if graph_function is None:
+                if 'live' in request.POST:
+                    context = {'stream_url': reverse('stream'), 'baseline': baseline, 'live': True}
+                else:
+                    context = baseline_context(baseline)
                 return render(request, 'result.html', {
-                    'img_path': 'normal_graph.png',
+                    **context,
                     'show_strategy_options': True,
                     'selected_strategy': strategy,
+                    'paired': 'paired' in request.POST,
                     'error': error,
                 })
 
+            # Draw the strategy in the browser as it is simulated instead of rendering a graph
+            if 'live' in request.POST:
+                return render(request, 'result.html', {
+                    'stream_url': reverse('stream') + '?' + urlencode({'strategy': strategy, 'new_value': new_value}),
+                    'baseline': baseline,
+                    'live': True,
+                    'show_strategy_options': True,
+                    'try_another_strategy': True,
+                })
+
+            # Show the graph for the selected strategy
+            # A paired comparison drives both scenarios with the same random numbers and adds their difference with its confidence band
+            paired = 'paired' in request.POST
+            # An adaptive baseline is compared with the statistics it showed rather than with 5 new replicates
+            old_stats = adaptive_result(baseline)['stats'] if baseline.get('tolerance') else None
+            graph = main.storeGraph(graph_function(
+                baseline['num_days'], baseline['population'],
+                baseline['recover_prob'], baseline['contact_rate'],
+                new_value,
+                seed = baseline.get('seed'), filename = None, paired = paired, old_stats = old_stats
+            ))
             return render(request, 'result.html', {
-                'img_path': img_path,
+                'graph': graph,
                 'show_strategy_options': True,
                 'try_another_strategy': True,
+                'paired': paired,
             })
 
     # Handling GET request
@@ -123,13 +225,120 @@ def result(request):
         baseline = request.session.get('baseline')
         if baseline:
             # If baseline is set, show the graph
-            main.normalGraph(baseline['num_days'], baseline['population'], baseline['recover_prob'], baseline['contact_rate'])
             return render(request, 'result.html', {
-                'img_path': 'normal_graph.png',
+                **baseline_context(baseline),
                 'show_strategy_options': True,
             })
         else:
             # Redirect to index if baseline data is missing
             return redirect('index')
 
-    return redirect('index')
\ No newline at end of file
+    return redirect('index')
+
+def run_graph_job(graph_function, args, seed, progress, **options):
+    # Run a graph function in a job and store the graph, returning its name
+    import main
+    return main.storeGraph(graph_function(*args, seed = seed, filename = None, progress = progress, **options))
+
+@require_POST
+async def submit_job(request):
+    # Queue the baseline or a strategy as a job and return its id at once; the fields are the same as for the result page
+    import main
+    if 'baseline_submitted' in request.POST:
+        form = SimulationForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status = 400)
+        baseline = {
+            'num_days': form.cleaned_data['num_days'],
+            'population': form.cleaned_data['population'],
+            'recover_prob': form.cleaned_data['recover_prob'],
+            'contact_rate': form.cleaned_data['contact_rate'],
+            'seed': random.randrange(2 ** 32),
+        }
+        await request.session.aset('baseline', baseline)
+        graph_function, args, options = main.normalGraph, (), {}
+    elif 'strategy' in request.POST:
+        baseline = await request.session.aget('baseline')
+        if not baseline:
+            return JsonResponse({'error': 'Please run a baseline first.'}, status = 400)
+        graph_function, new_value, error = parse_strategy(request.POST)
+        if graph_function is None:
+            return JsonResponse({'error': error or 'Please select a strategy.'}, status = 400)
+        args = (new_value,)
+        options = {'paired': 'paired' in request.POST}
+    else:
+        return JsonResponse({'error': 'Please submit a baseline or a strategy.'}, status = 400)
+
+    args = (baseline['num_days'], baseline['population'], baseline['recover_prob'], baseline['contact_rate']) + args
+    # Identical jobs that are still queued or running share one job
+    job_id = job_queue.submit((graph_function.__name__, args, baseline['seed'], tuple(sorted(options.items()))), partial(run_graph_job, **options), graph_function, args, baseline['seed'])
+    return JsonResponse({'id': job_id, 'status_url': reverse('job_status', args = [job_id])}, status = 202)
+
+@require_GET
+async def job_status(request, job_id):
+    # Report the progress of a job, and the address of its graph once it is done
+    job = job_queue.status(job_id)
+    if job is None:
+        raise Http404('Job not found.')
+    data = {'id': job['id'], 'status': job['status'], 'progress': job['progress']}
+    if job['status'] == 'done':
+        data['graph_url'] = reverse('graph', args = [job['result']])
+    elif job['status'] == 'failed':
+        data['error'] = job['error']
+    return JsonResponse(data)
+
+# Position of the parameter that each strategy changes in (num_days, population, recover_prob, contact_rate)
+STRATEGY_PARAMETERS = {
+    'strategy1': 3,
+    'strategy2': 2,
+    'strategy3': 1,
+}
+
+# Field of the result page that holds the new value of each strategy
+STRATEGY_FIELDS = {
+    'strategy1': 'new_contactRate',
+    'strategy2': 'new_recoverProb',
+    'strategy3': 'new_numPeople',
+}
+
+def stream_events(scenarios, seed):
+    # Yield a server-sent event with the average of every scenario for each day as soon as the day is simulated
+    import main
+    days = zip(*[main.iterAverageStats(*scenario, seed = seed) for scenario in scenarios])
+    for day, stats in enumerate(days, 1):
+        yield 'data: ' + json.dumps({'day': day, 'stats': stats}) + '\n\n'
+    yield 'event: done\ndata: {}\n\n'
+
+async def iterate_in_thread(iterator):
+    # Consume a synchronous iterator in a worker thread so that simulating does not block the event loop
+    next_item = sync_to_async(next, thread_sensitive = False)
+    sentinel = object()
+    while True:
+        item = await next_item(iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+def stream(request):
+    # Stream the daily averages of the baseline, and of the strategy given in the query string, as server-sent events
+    baseline = request.session.get('baseline')
+    if not baseline:
+        return JsonResponse({'error': 'Please run a baseline first.'}, status = 400)
+    scenario = [baseline['num_days'], baseline['population'], baseline['recover_prob'], baseline['contact_rate']]
+    scenarios = [tuple(scenario)]
+    strategy = request.GET.get('strategy')
+    if strategy in STRATEGY_PARAMETERS:
+        # Check the new value as the result page does, before the response starts
+        graph_function, new_value, error = parse_strategy({'strategy': strategy, STRATEGY_FIELDS[strategy]: request.GET.get('new_value')})
+        if graph_function is None:
+            return JsonResponse({'error': error}, status = 400)
+        scenario[STRATEGY_PARAMETERS[strategy]] = new_value
+        scenarios.append(tuple(scenario))
+
+    events = stream_events(scenarios, baseline.get('seed'))
+    if isinstance(request, ASGIRequest):
+        events = iterate_in_thread(events)
+    response = StreamingHttpResponse(events, content_type = 'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
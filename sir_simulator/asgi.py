@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sir_simulator.settings')
 
 application = get_asgi_application()
+
+# Load the simulation engines before the first request when SIMULATION_WARM_UP is set
+from simulations.apps import warm_up
+
+warm_up()
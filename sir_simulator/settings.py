@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that the time it reports covers the other middleware too
+    'simulations.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -123,3 +125,28 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'simulations/static')]
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Number of worker threads that run simulation jobs submitted to /jobs/
+SIMULATION_JOB_WORKERS = 2
+
+# Time the phases of every request and count the simulations, reported in a Server-Timing header, a log line and at /metrics; when False, the timers do nothing. It logs a line for every request, so it is off for development
+SIMULATION_INSTRUMENTATION = False
+
+# Import the simulation engines and matplotlib, and run them once, when the WSGI or ASGI application loads rather than on the first request that needs them; it makes every server process start later and take more memory, so it is off for development
+SIMULATION_WARM_UP = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'simulations.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sir_simulator.settings')
 
 application = get_wsgi_application()
+
+# Load the simulation engines before the first request when SIMULATION_WARM_UP is set
+from simulations.apps import warm_up
+
+warm_up()